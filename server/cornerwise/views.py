@@ -14,25 +14,16 @@ from shared import request
 from .contact import ContactForm
 
 
-def get_lot_sizes():
-    try:
-        q = LotQuantiles.objects.all()[0]
-        return {
-            "small": round(q.small_lot * 43560),
-            "medium": round(q.medium_lot * 43560)
-        }
-    except IndexError:
+def lot_sizes():
+    """Lot size thresholds (in square feet) shown in the lot size filter. Uses
+    the quantiles of the town with the lowest id.
+    """
+    quantiles = LotQuantiles.by_town()
+    if not quantiles:
         return {"small": 5000, "medium": 10000}
 
-
-LOT_SIZES = None
-
-
-def lot_sizes():
-    global LOT_SIZES
-    if not LOT_SIZES:
-        LOT_SIZES = get_lot_sizes()
-    return LOT_SIZES
+    small, medium = quantiles[min(quantiles)]
+    return {"small": round(small * 43560), "medium": round(medium * 43560)}
 
 
 def contact_us(request):
@@ -4,7 +4,8 @@ import imp
 import os
 
 from shared import importers
-from parcel.models import LotSize
+from shared.cache import bump_generation
+from parcel.models import CACHE_NAMESPACE, LotSize
 
 logger = logging.getLogger(__name__)
 
@@ -68,3 +69,4 @@ class Command(BaseCommand):
         self.stdout.write("Import complete")
 
         LotSize.refresh()
+        bump_generation(CACHE_NAMESPACE)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parcel', '0005_auto_20170404_2015'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='parcel',
+            name='town_id',
+            field=models.SmallIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
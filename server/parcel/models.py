@@ -1,6 +1,13 @@
 from django_pgviews import view as pg
 from django.contrib.gis.db import models
 
+from shared.cache import get_or_compute
+
+
+# Namespace for cached parcel data. Parcels are only changed by the addparcels
+# management command, which invalidates it.
+CACHE_NAMESPACE = "parcel"
+
 
 class ParcelManager(models.GeoManager):
     def containing(self, point):
@@ -20,7 +27,7 @@ class Parcel(models.Model):
     source = models.CharField(max_length=15, blank=True, null=True)
     plan_id = models.CharField(max_length=40, blank=True, null=True)
     last_edit = models.IntegerField(blank=True, null=True)
-    town_id = models.SmallIntegerField(blank=True, null=True)
+    town_id = models.SmallIntegerField(blank=True, null=True, db_index=True)
     shape = models.MultiPolygonField(srid=4326, blank=True, null=True)
 
     # Address:
@@ -65,6 +72,17 @@ class LotQuantiles(pg.View):
     class Meta:
         managed = False
 
+    @classmethod
+    def by_town(cls):
+        """Returns a dictionary mapping each town id to a (small_lot,
+        medium_lot) tuple. The quantiles are cached until parcels are
+        reimported. Parcels without a town are left out.
+        """
+        return get_or_compute(
+            CACHE_NAMESPACE, "town_lot_quantiles",
+            lambda: {q.town_id: (q.small_lot, q.medium_lot)
+                     for q in cls.objects.exclude(town_id__isnull=True)})
+
 
 class LotSize(pg.MaterializedView):
     """
@@ -6,9 +6,14 @@ from functools import reduce
 import json, operator, re
 
 from shared.address import normalize_number, normalize_street, split_address
+from shared.cache import request_etag, request_last_modified
 from shared.request import make_response, ErrorResponse
 
-from .models import Parcel, Attribute
+from .models import Parcel, Attribute, CACHE_NAMESPACE
+
+
+validators = {"etag": request_etag(CACHE_NAMESPACE),
+              "last_modified": request_last_modified(CACHE_NAMESPACE)}
 
 
 def make_query(d, reducer=operator.and_):
@@ -124,7 +129,7 @@ def make_parcel_data(parcel, include_attributes=False):
     return d
 
 
-@make_response()
+@make_response(**validators)
 def find_parcels(req):
     try:
         parcel = parcels_for_request(req)[0]
@@ -135,12 +140,12 @@ def find_parcels(req):
     return make_parcel_data(parcel, include_attributes=include_attributes)
 
 
-@make_response()
+@make_response(**validators)
 def view_parcel(req, pk):
     parcel = get_object_or_404(Parcel, pk=pk)
 
 
-@make_response()
+@make_response(**validators)
 def parcel_with_loc_id(req, loc_id=None):
     if not loc_id:
         loc_id = req.GET["loc_id"]
@@ -3,98 +3,173 @@ Helper functions for working with Documents.
 """
 
 from django.core.files import File
+from django.db import transaction
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dateutil.parser import parse as dt_parse
+import logging
+import os
 from os import path
-from dateutil.parser import parse
 import shutil
 import subprocess
-from urllib import parse, request
+import tempfile
+from urllib import parse
 
 from scripts import pdf
-from shared import files_metadata
+from shared import download, files_metadata
 from utils import extension
 
-from .models import Image
+from .models import DocumentText, Image
 
+LOGGER = logging.getLogger(__name__)
 
-def last_modified(url):
-    req = request.Request(url=url, method="HEAD")
-    with request.urlopen(req) as resp:
-        if "Last-Modified" in resp.headers:
-            return parse(resp.headers["Last-Modified"])
-
-    return None
+# pdftotext runs in a subprocess, so threads are enough to use every core:
+TEXT_WORKERS = os.cpu_count() or 2
 
 
 def doc_info(doc):
-    enc = doc.encoding
-    if doc.fulltext and doc.fulltext.path:
-        lines = (line.decode(enc) for line in doc.fulltext)
-    else:
-        lines = []
-
-    return {"field": doc.field, "title": doc.title, "lines": lines}
+    return {"field": doc.field, "title": doc.title,
+            "lines": doc.get_text().splitlines(True)}
+
+
+def save_texts(docs, workers=TEXT_WORKERS):
+    """Extract the text of Documents that have been copied to the local
+    filesystem, running up to `workers` extractions at once, and store it in
+    the database.
+
+    :returns: A list of the Documents whose text was saved
+    """
+    docs = [doc for doc in docs if doc.local_path]
+    saved = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(pdf.extract_text, doc.local_path): doc
+                   for doc in docs}
+        for future in as_completed(futures):
+            doc = futures[future]
+            try:
+                text, page_offsets = future.result()
+            except (OSError, subprocess.SubprocessError) as err:
+                LOGGER.error("Failed to extract text from Document #%s: %s",
+                             doc.pk, err)
+                continue
+
+            doc_text = DocumentText(document=doc, page_offsets=page_offsets)
+            doc_text.text = text
+            doc_text.save()
+            doc.extracted_text = doc_text
+            saved.append(doc)
+
+    return saved
 
 
 def save_from_url(doc, url, filename_base=None):
+    """Download a document to the local filesystem, streaming it to a
+    temporary file. If the document has already been downloaded, the request
+    is conditional, and the local copy is kept if the server responds with
+    304 Not Modified or sends back the same contents.
+
+    :returns: True if the local copy was created or replaced
+    """
     filename = path.basename(parse.urlsplit(url).path)
 
     if filename_base:
         filename = "{}.{}".format(filename_base, extension(filename))
 
-    with request.urlopen(url) as resp:
-        doc.document.save(filename, File(resp), save=False)
+    have_copy = bool(doc.document) and path.exists(doc.document.path)
+    with tempfile.NamedTemporaryFile() as tmp:
+        result = download.download(
+            url, tmp,
+            etag=have_copy and doc.etag,
+            last_modified=have_copy and doc.last_modified)
 
-        file_published = files_metadata.published_date(path)
+        changed = result.status != 304 and \
+            not (have_copy and result.sha256 == doc.sha256)
+        if changed:
+            old_name = doc.document.name if doc.document else None
+            tmp.seek(0)
+            doc.document.save(filename, File(tmp), save=False)
+            doc.file_size = result.size
+            doc.sha256 = result.sha256
 
-        if file_published:
-            doc.published = file_published
-        elif "Last-Modified" in resp.headers:
-            doc.published = dt_parse(resp.headers["Last-Modified"])
+            file_published = files_metadata.published_date(doc.document.path)
 
-        doc.save()
+            if file_published:
+                doc.published = file_published
+            elif result.last_modified:
+                doc.published = dt_parse(result.last_modified)
 
-    return doc
+    doc.etag = result.etag or ""
+    doc.last_modified = result.last_modified or ""
+    doc.save()
+
+    # Only remove the previous copy once the new one has been saved:
+    if changed and old_name and old_name != doc.document.name:
+        doc.document.storage.delete(old_name)
+
+    return changed
 
 
 def save_images(doc):
+    """Extract the images from a Document to files.
+
+    :returns: A list of unsaved Images
+    """
     if not doc.document:
         raise Exception("Document has not been copied to the local filesystem.")
-        return []
 
-    path = doc.document.path
-    image_gen = pdf.extract_images(path)
+    image_gen = pdf.extract_images(doc.document.path)
 
     images = []
-    # Do stuff with the images in the directory
     for i, (image_data, ext, w, h) in enumerate(image_gen):
         image = Image(proposal=doc.proposal, document=doc)
         image.width = w
         image.height = h
-        image.image.save("image-{:0>3}.{}".format(i, ext), image_data)
+        image.image.save("image-{:0>3}.{}".format(i, ext), image_data,
+                         save=False)
         images.append(image)
 
     return images
 
 
+def replace_images(doc):
+    """Extract the images from a Document, replacing the images extracted from
+    an earlier version of it. The new images are saved and the old ones
+    deleted in a single transaction.
+
+    :returns: A list of the new Images
+    """
+    images = save_images(doc)
+    old_ids = list(Image.objects.filter(document=doc)
+                   .values_list("pk", flat=True))
+    try:
+        with transaction.atomic():
+            for image in images:
+                image.save()
+            Image.objects.filter(pk__in=old_ids).delete()
+    except Exception:
+        for image in images:
+            image.image.delete(save=False)
+        raise
+
+    return images
+
+
 def generate_thumbnail(doc):
-    "Generate a Document thumbnail."
+    "Generate a Document thumbnail, replacing the existing one."
     if not doc.document:
-        task_logger.error("Document has not been copied to the local filesystem")
-        return
+        raise Exception("Document has not been copied to the local filesystem.")
 
-    path = doc.document.path
+    doc_path = doc.document.path
 
     # TODO: Dispatch on extension. Handle other common file types
-    if extension(path) != "pdf":
+    if extension(doc_path) != "pdf":
         return
 
-    out_prefix = path.join(path.dirname(path), "thumbnail")
+    out_prefix = path.join(path.dirname(doc_path), "thumbnail")
 
     proc = subprocess.Popen(
         [
-            "pdftoppm", "-jpeg", "-singlefile", "-scale-to", "200", path,
+            "pdftoppm", "-jpeg", "-singlefile", "-scale-to", "200", doc_path,
             out_prefix
         ],
         stderr=subprocess.PIPE)
@@ -105,6 +180,10 @@ def generate_thumbnail(doc):
 
     thumb_path = out_prefix + path.extsep + "jpg"
     with open(thumb_path, "rb") as thumb_file:
-        doc.thumbnail.save("thumbnail.jpg", File(thumb_file))
+        if doc.thumbnail:
+            doc.thumbnail.delete(save=False)
+        doc.thumbnail.save("thumbnail.jpg", File(thumb_file), save=False)
+    # Other processing stages may be updating the document concurrently:
+    doc.save(update_fields=["thumbnail"])
 
     return thumb_path
@@ -167,8 +167,7 @@ def matches_any(s, regexes):
 def get_lines(doc, strip_lines=strip_lines):
     """Returns a generator that successively produces lines from the
     document."""
-    enc = doc.encoding
-    lines = (line.decode(enc) for line in doc.fulltext
+    lines = (line for line in doc.get_text().splitlines(True)
              if not matches_any(line, strip_lines))
 
     return lines
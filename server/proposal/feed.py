@@ -1,19 +1,140 @@
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.contrib.syndication.views import Feed
+from django.db.models import Prefetch
+from django.http import HttpRequest, HttpResponse
 from django.utils.feedgenerator import Atom1Feed
+from django.views.decorators.http import condition
 
-from .models import Proposal
+from datetime import datetime, timezone
+import hashlib
+import time
+
+from shared import cache as cache_utils
+from .models import CACHE_NAMESPACE, Document, Proposal
+from .query import build_proposal_query, canonicalize_query
+
+
+# The filters accepted by the feeds, which work as they do for the list API:
+FEED_FILTERS = ("region", "box", "status")
+FEED_ITEMS = 50
+# Rendered feeds are remembered for regeneration after imports. To keep the
+# work bounded, stop remembering new filter sets after this many:
+MAX_REGISTERED_FEEDS = 500
+REGISTERED_FEEDS_KEY = "proposal_feeds"
+# Feeds past that limit are not regenerated, so they are only cached briefly:
+UNREGISTERED_FEED_TIMEOUT = 60*60
+# Box coordinates are rounded to this many decimal places (about 10 meters),
+# so that nearly identical boxes share a rendered feed:
+BOX_PRECISION = 4
+
+
+def feed_filters(query):
+    """Returns the canonical feed filters from a request's query parameters.
+    Unlike the list API, feeds include proposals of every status by default.
+    """
+    filters = {k: query[k] for k in FEED_FILTERS if query.get(k)}
+    filters.setdefault("status", "all")
+    if "box" in filters:
+        try:
+            coords = [round(float(coord), BOX_PRECISION)
+                      for coord in filters["box"].split(",")]
+        except ValueError:
+            coords = []
+        if len(coords) == 4:
+            filters["box"] = ",".join(str(coord) for coord in coords)
+        else:
+            del filters["box"]
+    return dict(canonicalize_query(filters))
+
+
+class FeedRequest(HttpRequest):
+    """Stands in for the request a feed was first rendered for, so that it can
+    be regenerated with the same absolute links outside of a request.
+    """
+    def __init__(self, host, secure):
+        super().__init__()
+        self.META["HTTP_HOST"] = host
+        self.secure = secure
+
+    def _get_scheme(self):
+        return "https" if self.secure else "http"
 
 
 class ReportsAndDecisionsFeed(Feed):
     title = "Somerville Reports and Decisions"
     link = "/proposals/"
     description = ""
+    name = "rss"
+
+    def __call__(self, request, *args, **kwargs):
+        """Serve the rendered feed from the cache. The feeds are rendered when
+        first requested and regenerated by regenerate_feeds after imports, so
+        polling a feed does not touch the database.
+        """
+        filters = feed_filters(request.GET)
+        rendered = cache.get(self.cache_key(filters, request.get_host(),
+                                            request.is_secure()))
+        if rendered is None or not rendered.get("registered") and \
+           rendered.get("generation") != cache_utils.generation(CACHE_NAMESPACE):
+            rendered = self.render(filters, request.get_host(),
+                                   request.is_secure())
+
+        def view(request):
+            return HttpResponse(rendered["xml"],
+                                content_type=rendered["content_type"])
+
+        rendered_at = datetime.fromtimestamp(rendered["rendered"],
+                                             timezone.utc)
+        return condition(etag_func=lambda _: rendered["etag"],
+                         last_modified_func=lambda _: rendered_at)(view)(
+                             request)
+
+    def cache_key(self, filters, host, secure):
+        # The rendered links are absolute, so they depend on the host and
+        # scheme:
+        return "proposal_feed:{}:{}".format(
+            self.name, cache_utils.hash_key([filters, host, secure]))
+
+    def render(self, filters, host, secure=False):
+        """Render the feed for the given filters and store it in the cache.
+        Registered feeds are kept until regenerate_feeds replaces them; others
+        expire after UNREGISTERED_FEED_TIMEOUT.
 
-    def items(self, request):
-        # TODO: Implement filters
-        return Proposal.objects.order_by("-modified")\
-                               .select_related()
+        :returns: A dictionary with the rendered `xml`, its `content_type`
+        and `etag`, the time it was `rendered`, the proposal cache
+        `generation` it was rendered from, and whether it is `registered`
+        """
+        # Read the generation first, so that changes made while the feed is
+        # rendering will cause it to be rendered again:
+        generation = cache_utils.generation(CACHE_NAMESPACE)
+        rendered_at = int(time.time())
+        feedgen = self.get_feed(filters, FeedRequest(host, secure))
+        xml = feedgen.writeString("utf-8")
+        registered = register_feed(self.name, filters, host, secure,
+                                   generation)
+        rendered = {"xml": xml,
+                    "content_type": feedgen.content_type,
+                    "etag": hashlib.sha1(xml.encode("utf-8")).hexdigest(),
+                    "rendered": rendered_at,
+                    "generation": generation,
+                    "registered": registered}
+        cache.set(self.cache_key(filters, host, secure), rendered,
+                  None if registered else UNREGISTERED_FEED_TIMEOUT)
+
+        return rendered
+
+    def items(self, filters):
+        return Proposal.objects.filter(build_proposal_query(filters))\
+                               .order_by("-modified")\
+                               .defer("search_vector")\
+                               .prefetch_related(
+                                   Prefetch("document_set",
+                                            queryset=Document.objects.only(
+                                                "proposal_id", "url"
+                                            ).order_by("pk"),
+                                            to_attr="feed_documents")
+                               )[0:FEED_ITEMS]
 
     def item_title(self, item):
         return item.summary
@@ -35,10 +156,8 @@ class ReportsAndDecisionsFeed(Feed):
     # the first 'decision' document if present, else something like
     # 'plans'.
     def item_enclosure_url(self, item):
-        document = item.document_set.all()[0]
-
-        if document:
-            return document.url
+        if item.feed_documents:
+            return item.feed_documents[0].url
 
     # TODO: Detect the appropriate MIME type
     item_enclosure_mime_type = "application/pdf"
@@ -49,3 +168,43 @@ class ReportsAndDecisionsFeed(Feed):
 class ReportsAndDecisionsAtom(ReportsAndDecisionsFeed):
     feed_type = Atom1Feed
     subtitle = ReportsAndDecisionsFeed.description
+    name = "atom"
+
+
+feed_classes = {feed.name: feed for feed in (ReportsAndDecisionsFeed,
+                                             ReportsAndDecisionsAtom)}
+
+
+def register_feed(name, filters, host, secure, generation):
+    """Remember a rendered feed for regeneration, unless the limit has been
+    reached.
+
+    :returns: True if the feed is registered
+    """
+    feeds = cache.get(REGISTERED_FEEDS_KEY, {})
+    key = cache_utils.hash_key([name, filters, host, secure])
+    if key in feeds or len(feeds) < MAX_REGISTERED_FEEDS:
+        feeds[key] = (name, filters, host, secure, generation)
+        cache.set(REGISTERED_FEEDS_KEY, feeds, None)
+        return True
+
+    return False
+
+
+def regenerate_feeds():
+    """Re-render the feeds that have been requested, skipping those rendered
+    since the proposal cache generation was last bumped. The generation is
+    bumped whenever proposals are saved or deleted (see
+    models.invalidate_proposal_cache).
+
+    :returns: The number of feeds that were rendered
+    """
+    current = cache_utils.generation(CACHE_NAMESPACE)
+    count = 0
+    for name, filters, host, secure, generation in \
+            cache.get(REGISTERED_FEEDS_KEY, {}).values():
+        if generation != current:
+            feed_classes[name]().render(filters, host, secure)
+            count += 1
+
+    return count
@@ -0,0 +1,156 @@
+"""
+iCalendar feeds of proposal events.
+
+Calendar clients poll their subscriptions every few minutes, but events only
+change when they are imported. The feeds are therefore generated once per
+import (see tasks.generate_calendars) and served from the cache.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from datetime import datetime, timedelta
+import hashlib
+import pytz
+
+from .models import Attribute, Event, Proposal
+
+
+# Include recent events, so that they do not vanish from calendars as soon as
+# they have started:
+CALENDAR_HISTORY = timedelta(days=30)
+
+EVENT_ATTRIBUTES = ["applicant_name", "legal_notice"]
+
+# Calendars are regenerated after every import, so this only needs to outlast
+# the interval between imports:
+CALENDAR_TIMEOUT = 60*60*48
+
+
+def calendar_key(region=None):
+    return "events_ics:" + (region or "")
+
+
+def calendar_events(region=None):
+    """Returns an Event queryset for the calendar feed, with the linked
+    proposals and their attributes prefetched.
+    """
+    since = pytz.utc.localize(datetime.utcnow()) - CALENDAR_HISTORY
+    events = Event.objects.filter(date__gte=since).order_by("date")
+    if region:
+        events = events.filter(region_name=region)
+
+    attributes = Attribute.objects.filter(handle__in=EVENT_ATTRIBUTES)
+    proposals = Proposal.objects.only("id", "address", "case_number")\
+                                .prefetch_related(
+                                    Prefetch("attributes",
+                                             queryset=attributes,
+                                             to_attr="included_attributes"))
+
+    return events.prefetch_related(Prefetch("proposals", queryset=proposals))
+
+
+def escape(text):
+    return text.replace("\\", "\\\\").replace(";", "\\;")\
+               .replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+
+def fold(line):
+    "Split a content line into lines of at most 75 octets (RFC 5545 3.1)."
+    encoded = line.encode("utf-8")
+    lines = []
+    while len(encoded) > 75:
+        cut = 75 if not lines else 74
+        # Do not split a multi-byte character:
+        while encoded[cut] & 0xC0 == 0x80:
+            cut -= 1
+        lines.append(encoded[:cut].decode("utf-8"))
+        encoded = encoded[cut:]
+    lines.append(encoded.decode("utf-8"))
+
+    return "\r\n ".join(lines)
+
+
+def format_time(dt):
+    return dt.astimezone(pytz.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def event_description(event):
+    parts = [event.description] if event.description else []
+    for proposal in event.proposals.all():
+        attributes = {a.handle: a.text_value
+                      for a in proposal.included_attributes}
+        summary = "{} ({})".format(proposal.address, proposal.case_number)
+        if attributes.get("applicant_name"):
+            summary += " - Applicant: " + attributes["applicant_name"]
+        parts.append(summary)
+        if attributes.get("legal_notice"):
+            parts.append(attributes["legal_notice"])
+
+    return "\n\n".join(parts)
+
+
+def event_lines(event, stamp):
+    lines = ["BEGIN:VEVENT",
+             "UID:event-{}@{}".format(event.pk, settings.SERVER_DOMAIN),
+             "DTSTAMP:" + stamp,
+             "DTSTART:" + format_time(event.date)]
+    if event.duration:
+        lines.append("DTEND:" + format_time(event.date + event.duration))
+    lines += ["SUMMARY:" + escape(event.title),
+              "LOCATION:" + escape(event.location),
+              "DESCRIPTION:" + escape(event_description(event))]
+    if event.minutes:
+        lines.append("URL:" + event.minutes)
+    lines.append("END:VEVENT")
+
+    return lines
+
+
+def make_calendar(events, name="Cornerwise Events"):
+    "Render an iterable of Events as an iCalendar string."
+    stamp = format_time(pytz.utc.localize(datetime.utcnow()))
+    lines = ["BEGIN:VCALENDAR",
+             "VERSION:2.0",
+             "PRODID:-//{}//Events//EN".format(settings.SERVER_DOMAIN),
+             "X-WR-CALNAME:" + escape(name)]
+    for event in events:
+        lines += event_lines(event, stamp)
+    lines.append("END:VCALENDAR")
+
+    return "\r\n".join(fold(line) for line in lines) + "\r\n"
+
+
+def render_calendar(region=None):
+    """Render the calendar for a region (or for all regions).
+
+    :returns: A dictionary with the calendar `text` and its `etag`
+    """
+    name = "Cornerwise Events" + (": " + region if region else "")
+    text = make_calendar(calendar_events(region), name)
+    return {"text": text,
+            "etag": hashlib.sha1(text.encode("utf-8")).hexdigest()}
+
+
+def generate_calendar(region=None):
+    "Render the calendar for a region and store it in the cache."
+    calendar = render_calendar(region)
+    cache.set(calendar_key(region), calendar, CALENDAR_TIMEOUT)
+
+    return calendar
+
+
+def get_calendar(region=None):
+    """Returns the cached calendar for a region, generating it if necessary.
+    Only the regions that have events are cached, since those are the ones
+    that tasks.generate_calendars keeps up to date; the calendar for any other
+    region is rendered on each request.
+    """
+    calendar = cache.get(calendar_key(region))
+    if calendar:
+        return calendar
+
+    if region and not Event.objects.filter(region_name=region).exists():
+        return render_calendar(region)
+
+    return generate_calendar(region)
@@ -53,19 +53,21 @@ class CambridgeImporter(object):
         self.api_key = api_key
         self.resource_id = resource
 
-    def query(self, soql):
+    def query(self, soql, run=None):
         req = make_request(self.domain, self.resource_id, self.api_key,
                            soql=soql)
         json = get_json(req)
+        if run:
+            run.pages += 1
         return map(self.process_json, json)
 
-    def updated_since(self, dt, *args, **kwargs):
+    def updated_since(self, dt, *args, run=None, **kwargs):
         # Some Socrata data sets support the :updated_at meta field, if they're
         # added using a tool that doesn't replace the entire dataset.
         soql = ("SELECT * WHERE applicationdate >= "
                 "'{dt}' OR decisiondate >= '{dt}'")\
                 .format(dt=dt.isoformat())
-        return self.query(soql)
+        return self.query(soql, run)
 
     copy_keys = {
         "case_number": "plan_number",
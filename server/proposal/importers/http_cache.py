@@ -0,0 +1,160 @@
+"""
+A local, on-disk HTTP cache for importers.
+
+Importers download the same pages and documents on every run. The cache stores
+each response body along with its ETag, Last-Modified date and a hash of its
+contents, and revalidates it with a conditional request, so an unchanged
+resource costs a single 304 round trip. Importers can use `fetch_parsed` to
+skip parsing entirely when the body has not changed.
+"""
+from django.conf import settings
+
+from collections import namedtuple
+from functools import lru_cache
+from hashlib import sha1, sha256
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_DIR = getattr(settings, "IMPORTER_CACHE_DIR",
+                    os.path.join(tempfile.gettempdir(), "importer_cache"))
+TIMEOUT = 60
+
+CachedResponse = namedtuple("CachedResponse",
+                            ["url", "body", "digest", "changed"])
+
+
+def entry_path(url):
+    return os.path.join(CACHE_DIR, sha1(url.encode("utf-8")).hexdigest())
+
+
+def write_atomic(path, data):
+    "Write bytes to a file, replacing it only once the write has finished."
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            outfile.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_entry(path):
+    "Returns the cached metadata and body for an entry, or (None, None)."
+    try:
+        with open(path + ".json") as infile:
+            meta = json.load(infile)
+        with open(path + ".body", "rb") as infile:
+            return meta, infile.read()
+    except (OSError, ValueError):
+        return None, None
+
+
+def fetch(url, timeout=TIMEOUT):
+    """Retrieve the body of a URL, revalidating the cached copy with a
+    conditional request if there is one.
+
+    :returns: A CachedResponse. Its `changed` attribute is False if the body
+    is the same as the cached body, whether the server responded with 304 Not
+    Modified or resent an identical body.
+    """
+    path = entry_path(url)
+    meta, cached_body = read_entry(path)
+
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        with urlopen(Request(url, headers=headers), timeout=timeout) as resp:
+            body = resp.read()
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+    except HTTPError as err:
+        if err.code == 304 and meta:
+            return CachedResponse(url, cached_body, meta["digest"], False)
+        raise
+
+    digest = sha256(body).hexdigest()
+    try:
+        write_atomic(path + ".body", body)
+        write_atomic(path + ".json",
+                     json.dumps({"url": url,
+                                 "etag": etag,
+                                 "last_modified": last_modified,
+                                 "digest": digest}).encode("utf-8"))
+    except OSError as err:
+        LOGGER.warning("Could not cache response from %s: %s", url, err)
+
+    return CachedResponse(url, body, digest,
+                          not meta or meta["digest"] != digest)
+
+
+@lru_cache()
+def module_hash(module_name):
+    "Returns a hash of the source of a loaded module, or '' if unavailable."
+    path = getattr(sys.modules.get(module_name), "__file__", None)
+    try:
+        with open(path, "rb") as infile:
+            return sha1(infile.read()).hexdigest()
+    except (OSError, TypeError):
+        return ""
+
+
+def parser_version(parse, version=None):
+    """Returns a short hash that identifies a parser: its explicit `version`
+    together with the source of the module that defines it.
+    """
+    digest = sha1(str(version).encode("utf-8"))
+    digest.update(module_hash(parse.__module__).encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+def fetch_parsed(url, parse, version=None, name=None, timeout=TIMEOUT):
+    """Retrieve a URL and parse its body with `parse`. The parsed value is
+    stored with the hash of the body it came from, and is reused without
+    calling `parse` for as long as the body is unchanged.
+
+    :param parse: a function that takes the response body (bytes) and
+    returns a picklable value
+    :param version: the importer's parser version. Bump it whenever parsing
+    changes outside of the module that defines `parse`, such as in a helper
+    module.
+    :param name: identifies the parser, so that the same URL can be parsed
+    in different ways; defaults to the function's name
+
+    Cached values are also keyed by `version` and a hash of the source of the
+    parser's module, so that changing the parser invalidates them.
+    """
+    response = fetch(url, timeout)
+    parsed_path = "{}.{}.{}.pickle".format(entry_path(url),
+                                           name or parse.__name__,
+                                           parser_version(parse, version))
+
+    try:
+        with open(parsed_path, "rb") as infile:
+            digest, value = pickle.load(infile)
+        if digest == response.digest:
+            return value
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+        pass
+
+    value = parse(response.body)
+    try:
+        write_atomic(parsed_path, pickle.dumps((response.digest, value)))
+    except (OSError, pickle.PicklingError, RecursionError) as err:
+        LOGGER.warning("Could not cache parsed response from %s: %s", url, err)
+
+    return value
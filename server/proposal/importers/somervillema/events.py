@@ -3,12 +3,13 @@ from io import BytesIO
 import itertools
 import pytz
 import re
-from urllib.request import urlopen
 
 from bs4 import BeautifulSoup
 from PyPDF2 import PdfFileReader
 from PyPDF2.utils import PdfReadError
 
+from .. import http_cache
+
 EVENTS_URL = "http://archive.somervillema.gov/PubMtgs.cfm"
 
 # This is hard-coded, because it's difficult to consistently extract from the
@@ -19,6 +20,10 @@ DEFAULT_DESCRIPTIONS = {"Zoning Board of Appeals": ("The ZBA is the Special Perm
 
                         "Planning Board": ("The Planning Board is the Special Permit Granting Authority for special districts and makes recommendations to the Board of Aldermen on zoning amendments.")}
 
+# Bump this whenever the parsing of meeting pages or agendas changes, to
+# invalidate cached parse results:
+PARSER_VERSION = 1
+
 DATE_FORMAT = "%b %d, %Y"
 POSTING_FORMAT = "%m/%d/%Y - %I:%M%p"
 
@@ -36,16 +41,11 @@ def title_for_case_number(case_number):
 
 
 def get_page(url):
-    with urlopen(url) as u:
-        return BeautifulSoup(u.read(), "html.parser")
+    return BeautifulSoup(http_cache.fetch(url).body, "html.parser")
 
 
 def get_pdf(url):
-    with urlopen(url) as u:
-        contents = u.read()
-        pdf_buffer = BytesIO(contents)
-
-    return PdfFileReader(pdf_buffer)
+    return PdfFileReader(BytesIO(http_cache.fetch(url).body))
 
 
 def pdf_lines(pdf):
@@ -104,17 +104,32 @@ def data_rows(doc):
     return [to_row(titles, tr) for tr in trs]
 
 
-def page_events(url, filt=lambda _: True):
-    page = get_page(url)
-    for row in filter(filt, data_rows(page)):
+def parse_rows(html):
+    return data_rows(BeautifulSoup(html, "html.parser"))
+
+
+def parse_agenda(contents):
+    "Returns the case numbers listed in an agenda PDF."
+    pdf = PdfFileReader(BytesIO(contents))
+    return [case["number"] for case in to_cases(pdf_lines(pdf))]
+
+
+def page_events(url, filt=lambda _: True, run=None):
+    # The pages and agendas are only parsed again if they have changed:
+    rows = http_cache.fetch_parsed(url, parse_rows, PARSER_VERSION)
+    if run:
+        run.pages += 1
+    for row in filter(filt, rows):
         agenda_url = row["Agenda"]["url"]
 
         try:
-            agenda_lines = pdf_lines(get_pdf(agenda_url))
+            case_numbers = http_cache.fetch_parsed(agenda_url, parse_agenda,
+                                                   PARSER_VERSION)
         except PdfReadError:
             continue
-
-        case_numbers = [case["number"] for case in to_cases(agenda_lines)]
+        finally:
+            if run:
+                run.pages += 1
 
         # Record as local datetime!
         date = TZ.localize(row["Date"].replace(hour=18, minute=0))
@@ -135,8 +150,8 @@ def page_events(url, filt=lambda _: True):
         }
 
 
-def get_events(since=None):
-    events = page_events(EVENTS_URL)
+def get_events(since=None, run=None):
+    events = page_events(EVENTS_URL, run=run)
 
     if since:
         if not since.tzinfo:
@@ -154,6 +169,6 @@ def get_events(since=None):
 class EventsImporter(object):
     region_name = "Somerville, MA"
 
-    def updated_since(self, dt):
-        return get_events(dt)
+    def updated_since(self, dt, run=None):
+        return get_events(dt, run)
 
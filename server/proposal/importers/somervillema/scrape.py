@@ -2,6 +2,8 @@
 Importer for Somerville Reports and Decisions.
 """
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import re
 from itertools import takewhile
@@ -10,6 +12,7 @@ import pytz
 from bs4 import BeautifulSoup
 
 from . import helpers
+from .. import http_cache
 from .events import DEFAULT_DESCRIPTIONS, title_for_case_number
 
 try:
@@ -30,6 +33,10 @@ URL_FORMAT = URL_BASE + "?page={:1}"
 HEARING_HOUR = 18
 HEARING_MIN = 0
 
+# Bump this whenever the parsing of Reports and Decisions pages changes,
+# including in helpers, to invalidate cached parse results:
+PARSER_VERSION = 1
+
 # Give the attributes a custom name:
 TITLES = {}
 
@@ -45,10 +52,8 @@ def attribute_for_title(title):
 # TODO: Return None or error if the response is not successful
 def get_page(page=1, url_format=URL_FORMAT):
     "Returns the HTML content of the given Reports and Decisions page."
-    url = url_format.format(page)
-    with urlopen(url) as html_page:
-        LOGGER.info("Fetching page %i", page)
-        return html_page.read()
+    LOGGER.info("Fetching page %i", page)
+    return http_cache.fetch(url_format.format(page)).body
 
 
 def detect_last_page(doc):
@@ -85,9 +90,17 @@ def add_geocode(geocoder, proposals):
     Modifies each proposal in the list (in place), adding 'lat' and 'long'
     matching the proposal address.
     """
-    addrs = [proposal["address"] for proposal in proposals]
-    locations = geocoder.geocode(addrs, region="Somerville, MA")
+    by_region = {}
+    for proposal in proposals:
+        by_region.setdefault(proposal["region_name"], []).append(proposal)
+
+    for region, region_proposals in by_region.items():
+        addrs = [proposal["address"] for proposal in region_proposals]
+        locations = geocoder.geocode(addrs, region=region)
+        add_locations(region_proposals, locations)
+
 
+def add_locations(proposals, locations):
     # Assumes the locations are returned in the same order
     for proposal, location in zip(proposals, locations):
         loc = location and location.get("location", None)
@@ -185,37 +198,74 @@ def get_proposals_for_page(page, geocoder=None):
     return cases
 
 
-def get_pages():
+def parse_page(html):
+    doc = BeautifulSoup(html, "html.parser")
+    return {"last_page": detect_last_page(doc),
+            "cases": find_cases(doc)}
+
+
+def get_page_cases(page, url_format=URL_FORMAT):
+    """Fetch and parse a Reports and Decisions page. If the page has not
+    changed since it was last parsed, the cached results are returned.
+
+    :returns: A dictionary with the index of the `last_page` and a list of
+    the `cases` on the page
+    """
+    LOGGER.info("Fetching page %i", page)
+    return http_cache.fetch_parsed(url_format.format(page), parse_page,
+                                   PARSER_VERSION)
+
+
+def get_pages(concurrency=1):
     """Returns a generator that retrieves Reports and Decisions pages and
-    parses them as HTML.
+    parses them with get_page_cases.
 
+    :param concurrency: The number of pages to fetch in parallel. Pages are
+    fetched ahead of the consumer, but are always produced in order. With a
+    concurrency of 1, each page is fetched only when the consumer asks for
+    it. Closing the generator cancels the pages that have not been fetched.
     """
-    i = 0
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    # The last page is not known until the first page has been loaded:
+    pending = deque([(0, pool.submit(get_page_cases, 0))])
+    next_page = 1
     last_page = None
 
-    while True:
-        try:
-            # There's currently a bug in the Reports and Decisions page
-            # that causes nonexistent pages to load page 1. They should
-            # return a 404 error instead!
-            html = get_page(i)
-        except HTTPError as err:
-            break
+    def fill():
+        nonlocal next_page
+        while next_page <= last_page and len(pending) < concurrency:
+            pending.append((next_page, pool.submit(get_page_cases,
+                                                   next_page)))
+            next_page += 1
+
+    try:
+        while pending:
+            i, future = pending.popleft()
+            try:
+                # There's currently a bug in the Reports and Decisions page
+                # that causes nonexistent pages to load page 1. They should
+                # return a 404 error instead!
+                page = future.result()
+            except HTTPError as err:
+                break
 
-        except URLError as err:
-            LOGGER.warning("Failed to retrieve URL for page %d.", i, err)
-            break
+            except URLError as err:
+                LOGGER.warning("Failed to retrieve URL for page %d: %s", i, err)
+                break
 
-        doc = BeautifulSoup(html, "html.parser")
-        if last_page is None:
-            last_page = detect_last_page(doc)
+            if last_page is None:
+                last_page = page["last_page"]
 
-        yield doc
+            if concurrency > 1:
+                fill()
 
-        i += 1
+            yield page
 
-        if i > last_page:
-            break
+            fill()
+    finally:
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
 
 
 def get_cases(gen=None):
@@ -223,15 +273,17 @@ def get_cases(gen=None):
     if not gen:
         gen = get_pages()
 
-    for doc in gen:
-        for case in find_cases(doc):
+    for page in gen:
+        for case in page["cases"]:
             yield case
 
 
 def get_proposals_since(dt=None,
                         stop_at_case=None,
                         date_column="updated_date",
-                        geocoder=None):
+                        geocoder=None,
+                        concurrency=1,
+                        run=None):
     """Page through the Reports and Decisions page, scraping the proposals
     until the submission date is less than or equal to the given date.
 
@@ -246,6 +298,11 @@ def get_proposals_since(dt=None,
     :geocoder: An object with a geocode() method that accepts a list
     of string addresses.
 
+    :param concurrency: The number of pages to fetch in parallel
+
+    :param run: (optional) an object with a `pages` attribute, which is
+    incremented for each page fetched
+
     :returns: A list of dicts representing scraped cases.
 
     """
@@ -256,7 +313,19 @@ def get_proposals_since(dt=None,
         return (not dt or case[date_column] > dt) and \
             (not stop_at_case or case["case_number"] != stop_at_case)
 
-    all_cases = list(takewhile(guard, get_cases()))
+    pages = get_pages(concurrency)
+
+    def count_pages():
+        for page in pages:
+            if run:
+                run.pages += 1
+            yield page
+
+    try:
+        all_cases = list(takewhile(guard, get_cases(count_pages())))
+    finally:
+        # Stop fetching once the guard has tripped:
+        pages.close()
 
     if geocoder:
         add_geocode(geocoder, all_cases)
@@ -268,10 +337,17 @@ class SomervilleImporter(object):
     region_name = "Somerville, MA"
     zone = pytz.timezone("US/Eastern")
 
-    def updated_since(self, since, geocoder=None):
+    def __init__(self, concurrency=4):
+        """
+        :param concurrency: The number of pages to fetch in parallel
+        """
+        self.concurrency = concurrency
+
+    def updated_since(self, since, geocoder=None, run=None):
         """Returns the proposals added or changed since the given datetime.
         """
         if not since.tzinfo:
             since = self.zone.localize(since)
 
-        return get_proposals_since(since, geocoder=geocoder)
+        return get_proposals_since(since, geocoder=geocoder,
+                                   concurrency=self.concurrency, run=run)
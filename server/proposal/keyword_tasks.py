@@ -19,9 +19,9 @@ else:
 
 
 # For testing:
-def add_full_text(r, doc):
+def add_full_text(r, doc, text=None):
     ""
-    terms = keywords.keywords(doc.get_text())
+    terms = keywords.keywords(text or doc.get_text())
     idf.add_document(r, terms, doc.pk)
 
 
@@ -33,8 +33,9 @@ def add_full_docs(docs):
         key = "keywords:" + doc.pk + ":added"
         if r.get(key):
             continue
-        if doc.fulltext:
-            add_full_text(r, doc)
+        text = doc.get_text()
+        if text:
+            add_full_text(r, doc, text)
             pipe.set(key, datetime.now().stamp())
 
     pipe.execute()
@@ -1,3 +1,4 @@
+from celery.result import AsyncResult
 from django.core.management.base import BaseCommand
 from proposal import tasks
 
@@ -32,7 +33,7 @@ class Command(BaseCommand):
     help = "Pull proposals from available importers."
 
     def add_arguments(self, parser):
-        parser.add_argument("since", nargs=1, type=datetype("%m/%d/%Y"),
+        parser.add_argument("since", nargs="?", type=datetype("%m/%d/%Y"),
                             help="specify start date for proposals to fetch",
                             default=(datetime.now() - timedelta(days=14)))
         parser.add_argument("-i", "--importer", default=None,
@@ -41,7 +42,7 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         start_time = datetime.now()
         result = tasks.pull_updates.delay(
-            options["since"],
+            options["since"].timestamp(),
             importers_filter=options["importer"])
 
         wait_count = 0
@@ -58,7 +59,9 @@ class Command(BaseCommand):
         self.stdout.write("Running tasks.pull_updates.\n"
                           "This may take some time.\n"
                           "Check the celery terminal for detailed logs.")
-        proposals = result.get()
+        # pull_updates starts the importers and returns the id of the task
+        # that saves their proposals:
+        proposals = AsyncResult(result.get()).get()
         duration = datetime.now().timestamp() - start_time.timestamp()
         self.stdout.write("Fetched {count} proposals in {duration}"
                           .format(count=len(proposals),
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposal', '0010_auto_20170709_1127'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='proposal',
+            index_together=set([('updated', 'id')]),
+        ),
+    ]
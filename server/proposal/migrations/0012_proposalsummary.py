@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.contrib.postgres.fields.jsonb
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposal', '0011_proposal_updated_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProposalSummary',
+            fields=[
+                ('proposal', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='summary', serialize=False, to='proposal.Proposal')),
+                ('image_id', models.IntegerField(null=True)),
+                ('image', models.FileField(null=True, upload_to='')),
+                ('image_url', models.URLField(null=True)),
+                ('image_thumbnail', models.FileField(null=True, upload_to='')),
+                ('attributes', django.contrib.postgres.fields.jsonb.JSONField()),
+            ],
+            options={
+                'managed': False,
+            },
+        ),
+    ]
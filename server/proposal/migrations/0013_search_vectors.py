@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposal', '0012_proposalsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proposal',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.RunSQL(
+            "CREATE AGGREGATE tsvector_agg (tsvector) "
+            "(SFUNC = tsvector_concat, STYPE = tsvector, INITCOND = '')",
+            "DROP AGGREGATE tsvector_agg (tsvector)"),
+        migrations.RunSQL(
+            "CREATE INDEX proposal_proposal_search_vector_gin "
+            "ON proposal_proposal USING gin(search_vector)",
+            "DROP INDEX proposal_proposal_search_vector_gin"),
+        # Index the existing proposals. Document text is indexed as it is
+        # extracted.
+        migrations.RunSQL(
+            """
+            UPDATE proposal_proposal p SET search_vector =
+                setweight(to_tsvector('english',
+                                      p.address || ' ' || p.other_addresses), 'A') ||
+                setweight(to_tsvector('english', p.summary), 'B') ||
+                setweight(to_tsvector('english', p.description || ' ' || coalesce(
+                    (SELECT string_agg(a.text_value, ' ') FROM proposal_attribute a
+                     WHERE a.proposal_id = p.id), '')), 'C')
+            """,
+            migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposal', '0013_search_vectors'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # Allows the handle to be included in the GIN index:
+        migrations.RunSQL(
+            "CREATE EXTENSION IF NOT EXISTS btree_gin",
+            migrations.RunSQL.noop),
+        # Supports attr.<handle>=<text> filters (text_value LIKE '%...%'):
+        migrations.RunSQL(
+            "CREATE INDEX proposal_attribute_handle_text_trgm "
+            "ON proposal_attribute "
+            "USING gin(handle, text_value gin_trgm_ops)",
+            "DROP INDEX proposal_attribute_handle_text_trgm"),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposal', '0014_attribute_trigram_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('importer', models.CharField(max_length=128)),
+                ('kind', models.CharField(choices=[('proposals', 'Proposals'), ('events', 'Events')], max_length=16)),
+                ('started', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished', models.DateTimeField(null=True)),
+                ('since', models.DateTimeField(null=True)),
+                ('pages', models.IntegerField(default=0, help_text='Pages or files fetched')),
+                ('seen', models.IntegerField(default=0, help_text='Records returned by the importer')),
+                ('created_count', models.IntegerField(default=0)),
+                ('updated_count', models.IntegerField(default=0)),
+                ('errors', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('succeeded', models.BooleanField(default=False)),
+                ('high_water_mark', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='importrun',
+            index_together=set([('importer', 'kind', 'started')]),
+        ),
+    ]
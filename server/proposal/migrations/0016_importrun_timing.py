@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposal', '0015_importrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importrun',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importrun',
+            name='fetched',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposal', '0016_importrun_timing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='etag',
+            field=models.CharField(default='', max_length=256),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='file_size',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='last_modified',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='sha256',
+            field=models.CharField(default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import zlib
+
+from scripts.pdf import join_pages
+
+# DocumentText.COMPRESS_OVER:
+COMPRESS_OVER = 4096
+
+
+def copy_extracted_text(apps, schema_editor):
+    """Copy the text files extracted by pdftotext into DocumentText rows. If a
+    document's text file cannot be read, its text will be extracted again.
+    """
+    Document = apps.get_model("proposal", "Document")
+    DocumentText = apps.get_model("proposal", "DocumentText")
+
+    for doc in Document.objects.exclude(fulltext="")\
+                               .exclude(fulltext__isnull=True)\
+                               .defer("search_vector").iterator():
+        try:
+            with open(doc.fulltext.path, "r",
+                      encoding=doc.encoding or "ISO-8859-9",
+                      errors="replace") as infile:
+                text, page_offsets = join_pages(infile.read())
+        except (OSError, ValueError):
+            doc.derived_from.pop("text", None)
+            doc.derived_from.pop("attributes", None)
+            doc.save(update_fields=["derived_from"])
+            continue
+
+        content = text.encode("utf-8")
+        compressed = len(content) > COMPRESS_OVER
+        DocumentText.objects.create(
+            document=doc,
+            content=zlib.compress(content) if compressed else content,
+            compressed=compressed,
+            page_offsets=page_offsets)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposal', '0018_document_derived_from'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentText',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='extracted_text', serialize=False, to='proposal.Document')),
+                ('content', models.BinaryField()),
+                ('compressed', models.BooleanField(default=False)),
+                ('page_offsets', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('extracted', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(copy_extracted_text,
+                             migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='document',
+            name='encoding',
+        ),
+        migrations.RemoveField(
+            model_name='document',
+            name='fulltext',
+        ),
+    ]
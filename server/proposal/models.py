@@ -2,15 +2,25 @@ from datetime import datetime
 
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import Point
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.search import SearchVectorField
 from django.core.urlresolvers import reverse
 from django.dispatch import receiver
-from django.db import IntegrityError
+from django.db import DatabaseError, IntegrityError, connection, transaction
 from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.forms.models import model_to_dict
+from django.utils import timezone
+
+from django_pgviews import view as pg
 
 import pickle
 import pytz
+import zlib
 import utils
+from shared import cache as cache_utils
+
+from . import tiles
 
 
 class ProposalManager(models.GeoManager):
@@ -37,6 +47,31 @@ class ProposalManager(models.GeoManager):
     def for_parcel(self, parcel):
         return self.filter(location__within=parcel.shape)
 
+    def update_search_vectors(self, ids):
+        """Recalculate the full text search vectors of the proposals with the
+        given ids, from their own text fields, their attributes and the text of
+        their documents.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(search_vector_sql, [list(ids)])
+
+
+# Addresses are weighted most heavily, then the summary, then the
+# description and attributes. Document text is given the least weight.
+search_vector_sql = """
+UPDATE proposal_proposal p SET search_vector =
+    setweight(to_tsvector('english',
+                          p.address || ' ' || p.other_addresses), 'A') ||
+    setweight(to_tsvector('english', p.summary), 'B') ||
+    setweight(to_tsvector('english', p.description || ' ' || coalesce(
+        (SELECT string_agg(a.text_value, ' ') FROM proposal_attribute a
+         WHERE a.proposal_id = p.id), '')), 'C') ||
+    setweight(coalesce(
+        (SELECT tsvector_agg(d.search_vector) FROM proposal_document d
+         WHERE d.proposal_id = p.id), ''), 'D')
+WHERE p.id = ANY(%s)
+"""
+
 
 def make_property_map():
     def _g(p):
@@ -94,8 +129,24 @@ class Proposal(models.Model):
     parcel = models.ForeignKey(
         "parcel.Parcel", related_name="proposals", null=True, on_delete=models.SET_NULL)
 
+    # Full text search vector, maintained by
+    # ProposalManager.update_search_vectors:
+    search_vector = SearchVectorField(null=True)
+
     objects = ProposalManager()
 
+    class Meta:
+        # Supports keyset pagination:
+        index_together = (("updated", "id"),)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the saved location, so that the cached map tiles there can
+        # be invalidated if the proposal moves:
+        instance.saved_location = instance.__dict__.get("location")
+        return instance
+
     def get_absolute_url(self):
         return reverse("view-proposal", kwargs={"pk": self.pk})
 
@@ -107,93 +158,162 @@ class Proposal(models.Model):
         """
         Constructs a Proposal from a dictionary.  If an existing proposal has a
         matching case number, update it from p_dict."""
+        return kls.create_or_update_proposals_from_dicts([p_dict])[0]
+
+    @classmethod
+    def create_or_update_proposals_from_dicts(kls, p_dicts, on_error=None):
+        """Create or update Proposals from a list of dictionaries produced by
+        the importers. Existing proposals are matched by case number.
+
+        The existing proposals, attributes, documents and events are loaded
+        with one query each, compared in memory, and new rows are inserted in
+        bulk. Only the proposals and attributes that actually changed are
+        updated. Because bulk inserts do not send signals, post_save is sent
+        explicitly for the new proposals and documents once the transaction
+        commits.
+
+        If saving the batch fails with a database error, such as a value that
+        is too long for its column, each dictionary is retried in its own
+        transaction, so that only the offending proposals are lost.
+
+        :param p_dicts: a list of dictionaries
+        :param on_error: if given, a function that is called with the
+        dictionary and the exception when a dictionary cannot be saved as a
+        Proposal, instead of raising the exception
+
+        :returns: a list of (created, proposal) tuples. If several
+        dictionaries have the same case number, only the last is used, and
+        dictionaries that could not be saved are left out.
+        """
+        errors = []
+        collect = on_error and (lambda p_dict, exc: errors.append((p_dict,
+                                                                   exc)))
         try:
-            proposal = kls.objects.get(case_number=p_dict["case_number"])
-            created = False
-        except kls.DoesNotExist:
-            proposal = kls(case_number=p_dict["case_number"])
-            created = True
+            with transaction.atomic():
+                results = kls._create_or_update_batch(p_dicts, collect)
+        except DatabaseError:
+            if not on_error:
+                raise
+
+            errors = []
+            results = []
+            by_case = {p_dict["case_number"]: p_dict for p_dict in p_dicts}
+            for p_dict in by_case.values():
+                try:
+                    with transaction.atomic():
+                        results += kls._create_or_update_batch([p_dict],
+                                                               collect)
+                except DatabaseError as exc:
+                    errors.append((p_dict, exc))
+
+        for p_dict, exc in errors:
+            on_error(p_dict, exc)
 
-        changed = not created
-        if changed:
-            prop_changes = []
+        return results
+
+    @classmethod
+    def _create_or_update_batch(kls, p_dicts, on_error=None):
+        "See create_or_update_proposals_from_dicts."
+        by_case = {p_dict["case_number"]: p_dict for p_dict in p_dicts}
+        existing = {p.case_number: p for p in
+                    kls.objects.filter(case_number__in=list(by_case))
+                               .defer("search_vector")}
+
+        new_proposals = []
+        # proposal -> property changes
+        changed = {}
+        proposals = {}
+        for case_number, p_dict in by_case.items():
+            proposal = existing.get(case_number)
+            created = proposal is None
+            if created:
+                proposal = kls(case_number=case_number)
 
+            try:
+                prop_changes = proposal.update_from_dict(p_dict, created)
+            except Exception as exc:
+                if on_error:
+                    on_error(p_dict, exc)
+                    continue
+                raise
+
+            if created:
+                new_proposals.append(proposal)
+            elif prop_changes:
+                changed[proposal] = prop_changes
+            proposals[case_number] = (created, proposal)
+
+        kls.objects.bulk_create(new_proposals)
+        for proposal, prop_changes in changed.items():
+            proposal.save(update_fields=[c["name"] for c in prop_changes] +
+                          ["modified"])
+
+        saved = [proposal for _, proposal in proposals.values()]
+        attr_changes = Attribute.update_from_dicts(
+            [(proposal, by_case[proposal.case_number]) for proposal in saved])
+        new_documents = Document.create_from_dicts(
+            [(proposal, by_case[proposal.case_number]) for proposal in saved])
+
+        Event.update_from_dicts(
+            [(event_json, [proposal]) for proposal in saved
+             for event_json in by_case[proposal.case_number].get("events")
+             or []])
+
+        Changeset.objects.bulk_create(
+            Changeset.from_changes(proposal, {
+                "properties": changed.get(proposal, []),
+                "attributes": attr_changes.get(proposal.pk, [])
+            })
+            for created, proposal in proposals.values()
+            if not created and (proposal in changed or
+                                proposal.pk in attr_changes))
+
+        kls.objects.update_search_vectors(p.pk for p in saved)
+
+        def send_signals():
+            # Attributes are inserted without signals:
+            invalidate_proposal_cache()
+            for proposal in saved:
+                if proposal.pk in attr_changes:
+                    tiles.invalidate_location(proposal.location)
+
+            for proposal in new_proposals:
+                post_save.send(kls, instance=proposal, created=True,
+                               update_fields=None, raw=False, using="default")
+            for document in new_documents:
+                post_save.send(Document, instance=document, created=True,
+                               update_fields=None, raw=False, using="default")
+
+        # The processing hooks start tasks that expect to find the new rows:
+        transaction.on_commit(send_signals)
+
+        return list(proposals.values())
+
+    def update_from_dict(self, p_dict, created):
+        """Set the Proposal's properties from an importer dictionary.
+
+        :returns: a list of the changed properties, or an empty list if the
+        proposal is new
+        """
+        prop_changes = []
         for p, fn in property_map:
-            old_val = changed and getattr(proposal, p)
+            old_val = not created and getattr(self, p)
             try:
                 val = fn(p_dict)
-                if changed and val != old_val:
+                if not created and val != old_val:
                     prop_changes.append({
                         "name": p,
                         "new": val,
                         "old": old_val
                     })
-                setattr(proposal, p, val)
+                setattr(self, p, val)
             except Exception as exc:
                 if old_val:
                     continue
                 raise Exception("Missing required property: %s\n Reason: %s" %
                                 (p, exc))
 
-        proposal.save()
-
-        proposal.create_events(p_dict.get("events"))
-
-        # Create associated documents:
-        proposal.create_documents((field, val["links"])
-                                  for field, val in p_dict.items()
-                                  if isinstance(val, dict) and val.get("links"))
-
-        if changed:
-            attr_changes = []
-        for attr_name, attr_val in p_dict.get("attributes", []):
-            try:
-                handle = utils.normalize(attr_name)
-                attr = proposal.attributes.get(handle=handle)
-                old_val = attr.text_value
-            except Attribute.DoesNotExist:
-                proposal.attributes.create(
-                    name=attr_name,
-                    handle=handle,
-                    text_value=attr_val,
-                    published=p_dict["updated_date"])
-                old_val = None
-            if changed:
-                attr_changes.append({
-                    "name": attr_name,
-                    "old": old_val,
-                    "new": attr_val
-                })
-
-        if changed:
-            changeset = Changeset.from_changes(proposal, {
-                "properties": prop_changes,
-                "attributes": attr_changes
-            })
-            changeset.save()
-
-        return (created, proposal)
-
-    def create_documents(self, docs):
-        for field, links in docs:
-            for link in links:
-                try:
-                    doc = proposal.document_set.get(url=link["url"])
-                except Document.DoesNotExist:
-                    doc = Document(proposal=proposal)
-
-                    doc.url = link["url"]
-                    doc.title = link["title"]
-                    doc.field = field
-                    doc.published = p_dict["updated_date"]
-
-                    doc.save()
-
-    def create_events(self, events_json):
-        if events_json:
-            for event_json in events_json:
-                event_json["cases"] = [self.case_number]
-                Event.make_event(event_json)
+        return prop_changes
 
 
 class Attribute(models.Model):
@@ -203,6 +323,10 @@ class Attribute(models.Model):
     proposal = models.ForeignKey(Proposal, related_name="attributes")
     name = models.CharField(max_length=128)
     handle = models.CharField(max_length=128, db_index=True)
+    # Set for attributes extracted from a document:
+    document = models.ForeignKey("Document", null=True,
+                                 on_delete=models.SET_NULL,
+                                 related_name="attributes")
 
     # Either the date when the source document was published or the date
     # when the attribute was observed:
@@ -239,6 +363,54 @@ class Attribute(models.Model):
         return self.text_value or \
             self.date_value
 
+    @classmethod
+    def update_from_dicts(cls, proposal_dicts):
+        """Create or update the attributes of saved Proposals from the
+        `attributes` of their importer dictionaries, loading the existing
+        attributes in one query.
+
+        :param proposal_dicts: a list of (proposal, p_dict) pairs
+
+        :returns: a dictionary mapping the ids of existing proposals to a list
+        of their attribute changes
+        """
+        existing = {(a.proposal_id, a.handle): a for a in
+                    cls.objects.filter(proposal__in=[p for p, _ in
+                                                     proposal_dicts])}
+        new_attributes = []
+        changes = {}
+        for proposal, p_dict in proposal_dicts:
+            for attr_name, attr_val in p_dict.get("attributes", []):
+                handle = utils.normalize(attr_name)
+                attr = existing.get((proposal.pk, handle))
+                if attr:
+                    old_val = attr.text_value
+                    if old_val == attr_val:
+                        continue
+                    attr.text_value = attr_val
+                    attr.published = p_dict["updated_date"]
+                    attr.save(update_fields=["text_value", "published"])
+                else:
+                    old_val = None
+                    attr = cls(proposal=proposal,
+                               name=attr_name,
+                               handle=handle,
+                               text_value=attr_val,
+                               published=p_dict["updated_date"])
+                    new_attributes.append(attr)
+                    # Guard against repeated attributes:
+                    existing[(proposal.pk, handle)] = attr
+
+                changes.setdefault(proposal.pk, []).append({
+                    "name": attr_name,
+                    "old": old_val,
+                    "new": attr_val
+                })
+
+        cls.objects.bulk_create(new_attributes)
+
+        return changes
+
 
 class EventManager(models.Manager):
     def upcoming(self):
@@ -272,7 +444,66 @@ class Event(models.Model):
         return d
 
     @classmethod
-    def make_event(cls, event_json):
+    def update_from_dicts(cls, event_dicts):
+        """Create or update Events from importer dictionaries and link them to
+        saved Proposals. Existing events are matched by title, date and region
+        and loaded in one query, as are their links to the proposals.
+
+        :param event_dicts: a list of (event_json, proposals) pairs, where
+        `event_json` is as described in make_event, without `cases`
+
+        :returns: a list of the Events
+        """
+        by_key = {}
+        for event_json, proposals in event_dicts:
+            k = (event_json["title"], event_json["date"],
+                 event_json["region_name"])
+            by_key[k] = (event_json, by_key.get(k, (None, []))[1] + proposals)
+        if not by_key:
+            return []
+
+        existing = {(e.title, e.date, e.region_name): e for e in
+                    cls.objects.filter(title__in={k[0] for k in by_key},
+                                       date__in={k[1] for k in by_key},
+                                       region_name__in={k[2] for k in by_key})}
+
+        keys = ("title", "date", "region_name", "duration")
+        events = {}
+        new_events = []
+        for k, (event_json, _) in by_key.items():
+            values = {f: event_json.get(f) for f in keys}
+            values["description"] = event_json.get("description") or ""
+            values["minutes"] = event_json.get("agenda_url") or ""
+            event = existing.get(k)
+            if event:
+                changed = [f for f, v in values.items()
+                           if getattr(event, f) != v]
+                if changed:
+                    for f in changed:
+                        setattr(event, f, values[f])
+                    event.save(update_fields=changed)
+            else:
+                event = cls(**values)
+                new_events.append(event)
+            events[k] = event
+
+        cls.objects.bulk_create(new_events)
+
+        Link = cls.proposals.through
+        links = {(events[k].pk, proposal.pk)
+                 for k, (_, proposals) in by_key.items()
+                 for proposal in proposals}
+        existing_links = set(Link.objects.filter(
+            event_id__in={e for e, _ in links},
+            proposal_id__in={p for _, p in links}
+        ).values_list("event_id", "proposal_id"))
+        Link.objects.bulk_create(Link(event_id=e, proposal_id=p)
+                                 for e, p in links - existing_links)
+
+        return list(events.values())
+
+    @classmethod
+    def make_event(cls, event_json, proposals=None):
         """
         event_json should have the following fields:
         - title (str) - Name of the event
@@ -282,6 +513,9 @@ class Event(models.Model):
         - region_name
         - duration (timedelta, optional) - how long will the event last?
         - agenda_url (string, optional)
+
+        :param proposals: (optional) a dictionary mapping case numbers to
+        Proposals that have already been loaded
         """
         keys = ("title", "description", "date", "region_name", "duration")
         try:
@@ -298,12 +532,15 @@ class Event(models.Model):
 
         event.save()
 
-        for case_number in event_json["cases"]:
-            try:
-                proposal = Proposal.objects.get(case_number=case_number)
-                event.proposals.add(proposal)
-            except Proposal.DoesNotExist:
-                continue
+        proposals = proposals or {}
+        missing = [case_number for case_number in event_json["cases"]
+                   if case_number not in proposals]
+        found = [proposals[case_number] for case_number in event_json["cases"]
+                 if case_number in proposals]
+        if missing:
+            found += Proposal.objects.filter(case_number__in=missing)
+        if found:
+            event.proposals.add(*found)
 
         return event
 
@@ -333,10 +570,18 @@ class Document(models.Model):
 
     # If the document has been copied to the local filesystem:
     document = models.FileField(null=True, upload_to=upload_document_to)
-
-    # File containing extracted text of the document:
-    fulltext = models.FileField(null=True)
-    encoding = models.CharField(max_length=20, default="")
+    # Size and SHA-256 hash of the local copy, and the validators the server
+    # sent with it, which are used to make conditional requests:
+    file_size = models.BigIntegerField(null=True)
+    sha256 = models.CharField(max_length=64, default="")
+    etag = models.CharField(max_length=256, default="")
+    last_modified = models.CharField(max_length=64, default="")
+    # Maps each processing stage (see tasks.process_stale_stages) to the hash
+    # of the input it last ran on:
+    derived_from = JSONField(default=dict)
+
+    # Full text search vector of the extracted text (see DocumentText):
+    search_vector = SearchVectorField(null=True)
     # File containing a thumbnail of the document:
     thumbnail = models.FileField(null=True, upload_to=upload_document_to)
 
@@ -349,7 +594,9 @@ class Document(models.Model):
 
     def to_dict(self):
         d = model_to_dict(
-            self, exclude=["event", "document", "fulltext", "thumbnail"])
+            self, exclude=["event", "document", "thumbnail",
+                           "search_vector", "sha256", "etag",
+                           "last_modified", "derived_from"])
         if self.thumbnail:
             d["thumb"] = self.thumbnail.url
 
@@ -358,14 +605,70 @@ class Document(models.Model):
 
         return d
 
+    @classmethod
+    def create_from_dicts(cls, proposal_dicts):
+        """Create the documents linked from the fields of saved Proposals'
+        importer dictionaries, skipping those that already exist. The existing
+        document URLs are loaded in one query.
+
+        :param proposal_dicts: a list of (proposal, p_dict) pairs
+
+        :returns: a list of the new Documents
+        """
+        existing = set(cls.objects.filter(
+            proposal__in=[p for p, _ in proposal_dicts]
+        ).values_list("proposal_id", "url"))
+
+        new_documents = []
+        for proposal, p_dict in proposal_dicts:
+            for field, val in p_dict.items():
+                if not (isinstance(val, dict) and val.get("links")):
+                    continue
+
+                for link in val["links"]:
+                    if (proposal.pk, link["url"]) in existing:
+                        continue
+                    existing.add((proposal.pk, link["url"]))
+                    new_documents.append(cls(proposal=proposal,
+                                             url=link["url"],
+                                             title=link["title"],
+                                             field=field,
+                                             published=p_dict["updated_date"]))
+
+        return cls.objects.bulk_create(new_documents)
+
     def get_text(self):
-        with open(self.fulltext.path, "r", encoding=self.encoding) as f:
-            return f.read()
+        "Returns the extracted text of the document, or '' if there is none."
+        try:
+            return self.extracted_text.text
+        except DocumentText.DoesNotExist:
+            return ""
 
     @property
     def local_path(self):
         return self.document and self.document.path or ""
 
+    def stage_is_current(self, stage, input_hash=None):
+        """Has the processing stage already run on this input? The input
+        defaults to the contents of the local copy.
+        """
+        input_hash = input_hash or self.sha256
+        return bool(input_hash) and self.derived_from.get(stage) == input_hash
+
+    def mark_processed(self, stage, input_hash=None):
+        """Record that the processing stage has run on the input. Stages run
+        concurrently, so the row is locked while it is updated.
+        """
+        with transaction.atomic():
+            derived_from = Document.objects.select_for_update()\
+                                           .values_list("derived_from",
+                                                        flat=True)\
+                                           .get(pk=self.pk)
+            derived_from[stage] = input_hash or self.sha256
+            Document.objects.filter(pk=self.pk)\
+                            .update(derived_from=derived_from)
+        self.derived_from = derived_from
+
     move_file = utils.make_file_mover("document")
 
 
@@ -376,8 +679,42 @@ def auto_delete_document(**kwargs):
         document.document.delete(save=False)
     if document.thumbnail:
         document.thumbnail.delete(save=False)
-    if document.fulltext:
-        document.fulltext.delete(save=False)
+
+
+class DocumentText(models.Model):
+    """
+    The normalized text extracted from a Document, stored as UTF-8. Longer
+    texts are compressed.
+    """
+    # Compress text longer than this many bytes:
+    COMPRESS_OVER = 4096
+
+    document = models.OneToOneField(Document, primary_key=True,
+                                    related_name="extracted_text")
+    content = models.BinaryField()
+    compressed = models.BooleanField(default=False)
+    # The offset in the text at which each page begins:
+    page_offsets = ArrayField(models.IntegerField(), default=list)
+    extracted = models.DateTimeField(auto_now=True)
+
+    @property
+    def text(self):
+        content = bytes(self.content)
+        if self.compressed:
+            content = zlib.decompress(content)
+        return content.decode("utf-8")
+
+    @text.setter
+    def text(self, text):
+        content = text.encode("utf-8")
+        self.compressed = len(content) > self.COMPRESS_OVER
+        self.content = zlib.compress(content) if self.compressed else content
+
+    def pages(self):
+        "Returns a list of the text of each page."
+        text = self.text
+        ends = self.page_offsets[1:] + [len(text)]
+        return [text[start:end] for start, end in zip(self.page_offsets, ends)]
 
 
 def upload_image_to(doc, filename):
@@ -429,6 +766,67 @@ def auto_delete_image(**kwargs):
         image.thumbnail.delete(save=False)
 
 
+# The attributes included with each proposal in list responses:
+LIST_ATTRIBUTES = ["applicant_name", "legal_notice", "dates_of_public_hearing"]
+
+
+class ProposalSummary(pg.MaterializedView):
+    """
+    Precomputes the list-level fields of each proposal that would otherwise
+    require querying other tables: its top-priority image and its
+    LIST_ATTRIBUTES (serialized as with Attribute.to_dict). Refresh after
+    proposals or their documents have been processed.
+    """
+    proposal = models.OneToOneField(Proposal, primary_key=True,
+                                    related_name="summary",
+                                    on_delete=models.DO_NOTHING)
+    image_id = models.IntegerField(null=True)
+    image = models.FileField(null=True)
+    image_url = models.URLField(null=True)
+    image_thumbnail = models.FileField(null=True)
+    attributes = JSONField()
+
+    concurrent_index = "proposal_id"
+
+    sql = """
+    SELECT p.id AS proposal_id,
+           img.id AS image_id, img.image AS image, img.url AS image_url,
+           img.thumbnail AS image_thumbnail,
+           COALESCE(attrs.attributes, '[]'::jsonb) AS attributes
+    FROM proposal_proposal p
+    LEFT JOIN LATERAL (
+        SELECT id, image, url, thumbnail FROM proposal_image i
+        WHERE i.proposal_id = p.id
+        ORDER BY priority DESC LIMIT 1) img ON true
+    LEFT JOIN LATERAL (
+        SELECT json_agg(CASE
+            WHEN a.text_value <> '' THEN json_build_object(
+                'name', a.name, 'handle', a.handle,
+                'value', a.text_value, 'value_type', 'text')
+            WHEN a.date_value IS NOT NULL THEN json_build_object(
+                'name', a.name, 'handle', a.handle,
+                'value', a.date_value, 'value_type', 'date')
+            ELSE json_build_object('name', a.name, 'handle', a.handle)
+            END)::jsonb AS attributes
+        FROM proposal_attribute a
+        WHERE a.proposal_id = p.id AND a.handle IN ({handles})) attrs ON true
+    """.format(handles=", ".join("'{}'".format(h) for h in LIST_ATTRIBUTES))
+
+    class Meta:
+        managed = False
+
+    def images_json(self):
+        "Returns the top-priority image, serialized as with Image.to_dict."
+        if not self.image_id:
+            return []
+
+        return [{
+            "id": self.image_id,
+            "src": self.image and self.image.url or self.image_url,
+            "thumb": self.image_thumbnail.url if self.image_thumbnail else None
+        }]
+
+
 class Changeset(models.Model):
     """
     Model used to record the changes to a Proposal over time.
@@ -457,3 +855,111 @@ class Changeset(models.Model):
     def changes(self, d):
         self._change_dict = d
         self.change_blob = pickle.dumps(d)
+
+
+class ImportRunManager(models.Manager):
+    def checkpoint(self, importer, kind):
+        """Returns the high-water mark of the importer's most recent
+        successful run, or None if it has not completed a run.
+        """
+        run = self.filter(importer=importer, kind=kind, succeeded=True,
+                          high_water_mark__isnull=False)\
+                  .order_by("-started").first()
+        return run and run.high_water_mark
+
+
+class ImportRun(models.Model):
+    """
+    Records a run of a proposal or event importer. Each importer resumes from
+    the high-water mark of its own last successful run.
+    """
+    PROPOSALS = "proposals"
+    EVENTS = "events"
+
+    importer = models.CharField(max_length=128)
+    kind = models.CharField(max_length=16,
+                            choices=((PROPOSALS, "Proposals"),
+                                     (EVENTS, "Events")))
+    started = models.DateTimeField(default=timezone.now)
+    # When the importer finished fetching, before its records were saved:
+    fetched = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+    attempts = models.IntegerField(default=0)
+    # The importer was asked for records updated after this time:
+    since = models.DateTimeField(null=True)
+    pages = models.IntegerField(default=0,
+                                help_text="Pages or files fetched")
+    seen = models.IntegerField(default=0,
+                               help_text="Records returned by the importer")
+    created_count = models.IntegerField(default=0)
+    updated_count = models.IntegerField(default=0)
+    errors = JSONField(default=list)
+    succeeded = models.BooleanField(default=False)
+    # The latest update time of the records imported, which is where the next
+    # run will start:
+    high_water_mark = models.DateTimeField(null=True)
+
+    objects = ImportRunManager()
+
+    class Meta:
+        index_together = (("importer", "kind", "started"),)
+
+    def add_error(self, message):
+        self.errors.append(str(message))
+
+    def finish(self, succeeded=True):
+        self.finished = timezone.now()
+        self.succeeded = succeeded
+        self.save()
+
+    @property
+    def fetch_time(self):
+        "Time spent fetching, as a timedelta, or None."
+        return self.fetched and (self.fetched - self.started)
+
+    @property
+    def save_time(self):
+        "Time spent saving the fetched records, as a timedelta, or None."
+        return self.fetched and self.finished and \
+            (self.finished - self.fetched)
+
+
+# Namespace for cached proposal data (e.g., list responses). Any change to a
+# model that is included in serialized proposals invalidates the namespace.
+CACHE_NAMESPACE = "proposal"
+
+
+def invalidate_proposal_cache(**kwargs):
+    cache_utils.bump_generation(CACHE_NAMESPACE)
+
+
+for sender in (Proposal, Attribute, Image, Document, Event,
+               "project.Project"):
+    for signal in (post_save, post_delete):
+        signal.connect(invalidate_proposal_cache, sender=sender,
+                       dispatch_uid="invalidate_proposal_cache")
+
+m2m_changed.connect(invalidate_proposal_cache, sender=Event.proposals.through,
+                    dispatch_uid="invalidate_proposal_cache")
+
+
+def invalidate_proposal_tiles(sender, instance, **kwargs):
+    "Invalidate the cached map tiles containing a changed proposal."
+    try:
+        proposal = instance if sender is Proposal else instance.proposal
+    except Proposal.DoesNotExist:
+        return
+    tiles.invalidate_location(proposal.location)
+
+    # The proposal may still be cached in the tiles at its old location:
+    saved_location = getattr(proposal, "saved_location", None)
+    if saved_location and saved_location != proposal.location:
+        tiles.invalidate_location(saved_location)
+    if sender is Proposal:
+        proposal.saved_location = proposal.location
+
+
+for sender in (Proposal, Attribute):
+    for signal in (post_save, post_delete):
+        signal.connect(invalidate_proposal_tiles, sender=sender,
+                       dispatch_uid="invalidate_proposal_tiles")
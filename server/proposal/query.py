@@ -1,6 +1,7 @@
 from django.contrib.gis.geos.polygon import Polygon
-from django.db.models import Q
-from collections import defaultdict
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Count, F, Q
 from functools import reduce
 import re
 
@@ -8,45 +9,67 @@ from .models import Attribute
 from parcel.models import LotSize, LotQuantiles
 
 
-def get_lot_size_groups():
-    quantiles = LotQuantiles.objects.all()[0]
-    return {
-        "small": {"lot_size__lte": quantiles.small_lot},
-        "medium": {"lot_size__lte": quantiles.medium_lot,
-                   "lot_size__gt": quantiles.small_lot},
-        "large": {"lot_size__gt": quantiles.medium_lot}
-    }
-
-LOT_SIZES = None
+class PrefixSearchQuery(SearchQuery):
+    """A full text search query that matches lexemes starting with each of the
+    words in the query, so that partially typed addresses and names match.
+    """
+    def __init__(self, text, **extra):
+        words = re.findall(r"\w+", text)
+        extra.setdefault("config", "english")
+        super().__init__(" & ".join(w + ":*" for w in words), **extra)
+
+    def as_sql(self, compiler, connection):
+        config_sql, config_params = compiler.compile(self.config)
+        template = "to_tsquery({}::regconfig, %s)".format(config_sql)
+        if self.invert:
+            template = "!!({})".format(template)
+        return template, config_params + [self.value]
+
+
+# Lot size ranges, given a town's lot size quantiles:
+lot_size_groups = {
+    "small": lambda small, medium: {"lot_size__lte": small},
+    "medium": lambda small, medium: {"lot_size__lte": medium,
+                                     "lot_size__gt": small},
+    "large": lambda small, medium: {"lot_size__gt": medium}
+}
 
-def get_lot_sizes():
-    global LOT_SIZES
-    if not LOT_SIZES:
-        LOT_SIZES = get_lot_size_groups()
 
-    return LOT_SIZES
+def make_size_query(param):
+    """Construct a LotSize query from a `lotsize` parameter. Small, medium and
+    large lots are defined relative to the other lots in the same town.
 
+    :param param: "small", "medium", "large", or a comparison with a size (in
+    acres), e.g., "<0.5"
 
-def make_size_query(param):
-    size_query = get_lot_sizes().get(param.lower())
-    if size_query:
-        return size_query
+    :returns: A Q object, or None if the parameter is not recognized
+    """
+    group = lot_size_groups.get(param.lower())
+    if group:
+        quantiles = LotQuantiles.by_town()
+        return reduce(Q.__or__,
+                      (Q(parcel__town_id=town_id, **group(small, medium))
+                       for town_id, (small, medium) in quantiles.items()),
+                      Q())
 
     m = re.match(r"([<>])(=?)(\d+(\.\d+)?)", param)
     if m:
         size_op = "lot_size__{op}{eq}".format(
             op="lt" if m.group(1) == "<" else "gt",
             eq="e" if m.group(2) else "")
-        return {size_op: float(m.group(3))}
+        return Q(**{size_op: float(m.group(3))})
 
 
-def run_attributes_query(d):
-    """Construct a Proposal query from query parameters.
+def attributes_query(d):
+    """Construct a subquery selecting the ids of the proposals whose attributes
+    match all the `attr.<handle>` parameters in d. The subquery is evaluated by
+    the database as part of the proposal query.
 
     :param d: A dictionary-like object, typically something like
     request.GET.
 
-    :returns: A
+    :returns: An Attribute QuerySet of proposal ids, or None if there are no
+    attribute filters
     """
     subqueries = []
 
@@ -58,14 +81,12 @@ def run_attributes_query(d):
 
     if subqueries:
         query = reduce(Q.__or__, subqueries, Q())
-        attrs = Attribute.objects.filter(query)\
-                                 .values("proposal_id", "handle",
-                                         "text_value")
-        attr_maps = defaultdict(int)
-        for attr in attrs:
-            attr_maps[attr["proposal_id"]] += 1
-
-        return [pid for pid, c in attr_maps.items() if c == len(subqueries)]
+        return Attribute.objects.filter(query)\
+                                .values("proposal_id")\
+                                .annotate(matches=Count("handle",
+                                                        distinct=True))\
+                                .filter(matches=len(subqueries))\
+                                .values("proposal_id")
 
 
 query_params = {
@@ -77,13 +98,18 @@ query_params = {
 
 def build_proposal_query_dict(d):
     subqueries = {}
-    ids = run_attributes_query(d) or []
+    ids = None
 
     if "id" in d:
         ids = re.split(r"\s*,\s*", d["id"])
 
-    if "text" in d:
-        subqueries["address__icontains"] = d["text"]
+    attr_ids = attributes_query(d)
+    if attr_ids is not None:
+        # Use a different key than the explicit ids, so both filters apply:
+        subqueries["id__in"] = attr_ids
+
+    if d.get("text"):
+        subqueries["search_vector"] = PrefixSearchQuery(d["text"])
 
     if d.get("region"):
         regions = re.split(r"\s*;\s*", d["region"])
@@ -101,7 +127,7 @@ def build_proposal_query_dict(d):
     if "lotsize" in d:
         parcel_query = make_size_query(d["lotsize"])
         if parcel_query:
-            parcel_ids = LotSize.objects.filter(**parcel_query).values("parcel_id")
+            parcel_ids = LotSize.objects.filter(parcel_query).values("parcel_id")
             subqueries["parcel_id__in"] = parcel_ids
 
     bounds = d.get("box")
@@ -135,6 +161,91 @@ def build_proposal_query_dict(d):
     return subqueries
 
 
+# Parameters that affect how a response is rendered, but not which proposals
+# it includes:
+presentation_params = {"callback", "format", "_"}
+
+
+def canonicalize_query(d):
+    """Normalize a proposal query dictionary, so that equivalent queries are
+    represented identically. Used for building cache keys.
+
+    :param d: A dictionary-like object, typically request.GET
+
+    :returns: A list of (key, value) pairs, sorted by key
+    """
+    canonical = {}
+    for k in d:
+        if k in presentation_params:
+            continue
+        canonical[k] = d[k]
+
+    bounds = canonical.get("box")
+    if bounds:
+        try:
+            coords = [float(coord) for coord in bounds.split(",")]
+            canonical["box"] = ",".join(repr(c) for c in coords)
+        except ValueError:
+            pass
+
+    if canonical.get("region"):
+        regions = re.split(r"\s*;\s*", canonical["region"])
+        canonical["region"] = ";".join(sorted(set(regions)))
+
+    canonical["status"] = canonical.get("status", "active").lower()
+
+    return sorted(canonical.items())
+
+
 def build_proposal_query(d):
     subqueries = build_proposal_query_dict(d)
     return Q(**subqueries)
+
+
+def rank_proposals(proposals, d):
+    """If the query includes a `text` search and asks for results to be sorted
+    by relevance (sort=relevance), order the proposals by their full text
+    search rank.
+
+    :param proposals: A Proposal QuerySet, typically filtered using
+    build_proposal_query(d)
+    :param d: A dictionary-like object, typically request.GET
+    """
+    if d.get("text") and d.get("sort") == "relevance":
+        rank = SearchRank(F("search_vector"), PrefixSearchQuery(d["text"]))
+        return proposals.annotate(rank=rank).order_by("-rank")
+
+    return proposals
+
+
+cluster_sql = """
+SELECT count(*),
+       ST_X(ST_Centroid(ST_Collect(location))),
+       ST_Y(ST_Centroid(ST_Collect(location))),
+       (array_agg(id ORDER BY updated DESC))[1:%s]
+FROM ({subquery}) proposals
+GROUP BY ST_SnapToGrid(location, %s)
+"""
+
+
+def proposal_clusters(proposals, cell_size, sample_size=5):
+    """Group the proposals into square grid cells using PostGIS.
+
+    :param proposals: A Proposal QuerySet
+    :param cell_size: Width of the grid cells, in degrees
+    :param sample_size: Maximum number of proposal ids to return for each cell
+
+    :returns: A list of dictionaries with "count", "location" (the centroid of
+    the proposals in the cell) and "ids" (of the most recently updated
+    proposals in the cell) keys
+    """
+    subquery, params = proposals.values("id", "location", "updated")\
+                                .query.sql_with_params()
+    sql = cluster_sql.format(subquery=subquery)
+    with connections[proposals.db].cursor() as cursor:
+        cursor.execute(sql, (sample_size, ) + tuple(params) + (cell_size, ))
+        return [{"count": count,
+                 "location": {"lat": lat, "lng": lng},
+                 "ids": ids}
+                for count, lng, lat, ids in cursor.fetchall()]
+
@@ -1,26 +1,36 @@
 from datetime import datetime, timedelta
+import hashlib
 import logging
 import os
-import subprocess
 from urllib import parse, request
 
 import celery
+from celery.exceptions import Retry, SoftTimeLimitExceeded
 from celery.utils.log import get_task_logger
 
 from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.core.cache import cache
 from django.core.files import File
 from django.dispatch import receiver
+from django.db import transaction
+from django.db.models import Value
 from django.db.models.signals import post_save
 from django.db.utils import DataError, IntegrityError
+from django.utils import timezone
 
 import pytz
 
-from .models import Proposal, Attribute, Document, Event, Image
+from .models import (CACHE_NAMESPACE, Proposal, Attribute, Document, Event,
+                     Image, ImportRun, ProposalSummary)
 from utils import extension, normalize
 from . import extract
+from . import feed
+from . import ical
 from . import documents as doc_utils
 from .importers.register import Importers, EventImporters
 from scripts import arcgis, foursquare, gmaps, street_view
+from shared import cache as cache_utils
 
 
 logger = logging.getLogger(__name__)
@@ -28,62 +38,112 @@ task_logger = get_task_logger(__name__)
 shared_task = celery.shared_task
 
 
+# Wait this long (in seconds) before refreshing the proposal summaries, so that
+# a burst of changes triggers only one refresh:
+SUMMARY_REFRESH_DELAY = 60
+SUMMARY_REFRESH_KEY = "proposal_summary:refresh_scheduled"
+
+# Default per-importer settings, which an importer can override with
+# `time_limit` and `max_retries` attributes:
+IMPORTER_TIME_LIMIT = 60*15
+IMPORTER_RETRIES = 2
+RETRY_DELAY = 60*5
+# Fetched proposals are kept in the cache until they are saved:
+IMPORTER_RESULTS_TIMEOUT = 60*60*24
+SAVE_TIME_LIMIT = 60*10
+
+
+@shared_task
+def refresh_proposal_summaries():
+    cache.delete(SUMMARY_REFRESH_KEY)
+    ProposalSummary.refresh(concurrently=True)
+    # Responses cached since the change that scheduled the refresh were built
+    # from the stale summaries:
+    cache_utils.bump_generation(CACHE_NAMESPACE)
+
+
+def schedule_summary_refresh():
+    "Refresh the proposal summaries, unless a refresh is already scheduled."
+    if cache.add(SUMMARY_REFRESH_KEY, True, SUMMARY_REFRESH_DELAY * 2):
+        refresh_proposal_summaries.apply_async(countdown=SUMMARY_REFRESH_DELAY)
+
+
+@shared_task
+def regenerate_feeds():
+    "Re-render the cached RSS and Atom feeds that include changed proposals."
+    count = feed.regenerate_feeds()
+    task_logger.info("Regenerated %i feeds", count)
+
+
+@shared_task
+def generate_calendars():
+    """Regenerate the cached iCalendar feed of events for each region and for
+    all regions together.
+    """
+    regions = Event.objects.values_list("region_name", flat=True).distinct()
+    for region in [None] + list(regions):
+        ical.generate_calendar(region)
+
+
 @shared_task
 def fetch_document(doc_id):
     """Copy the given document (proposal.models.Document) to a local
     directory.
     """
     doc = Document.objects.get(pk=doc_id)
-    url = doc.url
-
-    if doc.document and os.path.exists(doc.document.path):
-        # Has the document been updated?
-        updated = doc_utils.last_modified(doc.url)
-        # No?  Then we're good.
-        if not updated or updated <= doc.published:
-            return doc.pk
-
-        # TODO Special handling of updated documents
 
+    # If there is already a local copy, this is a conditional request:
     task_logger.info("Fetching Document #%i", doc.pk)
-    doc_utils.save_from_url(doc, url, "download")
-    task_logger.info("Copied Document #%i to %s", doc.pk, doc.document.path)
+    if doc_utils.save_from_url(doc, doc.url, "download"):
+        task_logger.info("Copied Document #%i to %s (%i bytes)", doc.pk,
+                         doc.document.path, doc.file_size)
+    else:
+        task_logger.info("Document #%i is unchanged", doc.pk)
 
     return doc.pk
 
 
 @shared_task
-def extract_text(doc_id, encoding="ISO-8859-9"):
-    """If a document is a PDF that has been copied to the filesystem, extract its
-    text contents to a file and save the path of the text document.
+def extract_text(doc_id):
+    """If a document has been copied to the filesystem, extract its text
+    contents and store them in the database.
+
+    :returns: The document id, or None if extraction failed
+    """
+    extracted = extract_texts([doc_id])
+    return extracted[0] if extracted else None
 
-    :param doc: proposal.models.Document object
 
-    :returns: The same document
+@shared_task
+def extract_texts(doc_ids):
+    """Extract the text of several documents at once, using a pool of
+    workers, then index it.
 
+    :returns: The ids of the documents whose text was extracted
     """
-    doc = Document.objects.get(pk=doc_id)
-    path = doc.local_path
-    # Could consider storing the full extracted text of the document in
-    # the database and indexing it, rather than extracting it to a file.
-    text_path = os.path.join(os.path.dirname(path), "text.txt")
-
-    # TODO: It may be practical to sniff pdfinfo, determine the PDF
-    # producer used, and make a best guess at encoding based on that
-    # information. We should be able to get away with using ISO-8859-9
-    # for now.
-    status = subprocess.call(["pdftotext", "-enc", encoding, path, text_path])
-
-    if status:
-        task_logger.error("Failed to extract text from %s", path)
-    else:
-        task_logger.info("Extracted text from Document #%i to %s.", doc.pk,
-                         doc.fulltext)
-        doc.fulltext = text_path
-        doc.encoding = encoding
-        doc.save()
+    docs = doc_utils.save_texts(Document.objects.filter(pk__in=doc_ids)
+                                                .defer("search_vector"))
+    for doc in docs:
+        task_logger.info("Extracted text from Document #%i.", doc.pk)
+        index_document_text(doc)
+        doc.mark_processed("text")
+
+    return [doc.pk for doc in docs]
 
-        return doc.pk
+
+# tsvectors are limited to 1MB, so only index the beginning of very long
+# documents:
+INDEXED_TEXT_LENGTH = 100000
+
+
+def index_document_text(doc):
+    """Update the full text search vector for a document with extracted text,
+    then update the search vector of its proposal.
+    """
+    text = doc.get_text()[0:INDEXED_TEXT_LENGTH]
+    Document.objects.filter(pk=doc.pk).update(
+        search_vector=SearchVector(Value(text), config="english"))
+    Proposal.objects.update_search_vectors([doc.proposal_id])
 
 
 @shared_task
@@ -102,15 +162,20 @@ def extract_images(doc_id):
 
     try:
         task_logger.info("Extracting images from Document #%s", doc.pk)
-        images = doc_utils.save_images(doc)
-        task_logger.info("Extracted %i image(s) from %s.", len(images), path)
-
-        return [image.pk for image in images]
+        images = doc_utils.replace_images(doc)
+        task_logger.info("Extracted %i image(s) from Document #%s.",
+                         len(images), doc.pk)
     except Exception as exc:
         task_logger.error(exc)
 
         return []
 
+    doc.mark_processed("images")
+    # The summaries may refer to the images that were replaced:
+    transaction.on_commit(schedule_summary_refresh)
+
+    return [image.pk for image in images]
+
 
 @shared_task
 def add_street_view(proposal_id):
@@ -133,6 +198,7 @@ def add_street_view(proposal_id):
                     skip_cache=True,
                     source="google_street_view",
                     priority=1)
+                schedule_summary_refresh()
                 return image
         except IntegrityError:
             task_logger.warning("Image with that URL already exists: %s", url)
@@ -168,6 +234,7 @@ def add_venue_info(proposal_id):
         if venue["url"]:
             proposal.attributes.create(
                 name="foursquare_url", text_value=venue["url"])
+        Proposal.objects.update_search_vectors([proposal.pk])
 
     return proposal_id
 
@@ -194,7 +261,10 @@ def generate_doc_thumbnail(doc_id):
             "Document has not been copied to the local filesystem")
         return
 
-    return doc_utils.generate_thumbnail(doc)
+    thumb_path = doc_utils.generate_thumbnail(doc)
+    doc.mark_processed("thumbnail")
+
+    return thumb_path
 
 
 @shared_task
@@ -226,40 +296,66 @@ def generate_thumbnail(image_id, replace=False):
                          thumbnail_path)
         image.thumbnail = thumbnail_path
         image.save()
+        schedule_summary_refresh()
 
     return thumbnail_path
 
 
 @shared_task
 def add_doc_attributes(doc_id):
+    """Extract attributes from a Document's text, replacing the attributes
+    extracted from an earlier version of it. Skipped if the text is the same
+    as when the attributes were last extracted.
+    """
     doc = Document.objects.get(pk=doc_id)
-    doc_json = doc_utils.doc_info(doc)
-    properties = extract.get_properties(doc_json)
-
-    for name, value in properties.items():
-        task_logger.info("Adding %s attribute", name)
-        published = doc.published or datetime.now()
-        handle = normalize(name)
+    text = doc.get_text()
+    if not text:
+        return
 
-        try:
-            attr = Attribute.objects.get(proposal=doc.proposal, handle=handle)
-        except Attribute.DoesNotExist:
-            attr = Attribute(
-                proposal=doc.proposal,
-                name=name,
-                handle=normalize(name),
-                published=published)
-            attr.set_value(value)
-        else:
-            # TODO: Either mark the old attribute as stale and create a
-            # new one or create a record that the value has changed
-            if published > attr.published:
-                attr.clear_value()
-                attr.set_value(value)
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    if doc.stage_is_current("attributes", text_hash):
+        task_logger.info("Text of Document #%i is unchanged", doc.pk)
+        return doc.pk
 
-        attr.save()
+    doc_json = doc_utils.doc_info(doc)
+    properties = extract.get_properties(doc_json)
+    published = doc.published or timezone.now()
+    handles = {normalize(name): name for name in properties}
+
+    with transaction.atomic():
+        existing = {
+            attr.handle: attr for attr in
+            Attribute.objects.select_for_update().filter(
+                proposal_id=doc.proposal_id, handle__in=list(handles))
+        }
+
+        for handle, name in handles.items():
+            attr = existing.get(handle)
+            if not attr:
+                task_logger.info("Adding %s attribute", name)
+                attr = Attribute(proposal_id=doc.proposal_id, name=name,
+                                 handle=handle)
+            elif attr.document_id != doc.pk and \
+                 published <= attr.published:
+                # The attribute came from a more recent source:
+                continue
+
+            attr.clear_value()
+            attr.set_value(properties[name])
+            attr.published = published
+            attr.document = doc
+            attr.save()
+
+        # Remove the attributes that the new version no longer has:
+        Attribute.objects.filter(document=doc)\
+                         .exclude(handle__in=list(handles))\
+                         .delete()
+        doc.mark_processed("attributes", text_hash)
+
+    Proposal.objects.update_search_vectors([doc.proposal_id])
+    schedule_summary_refresh()
 
-    return doc
+    return doc.pk
 
 
 @shared_task
@@ -267,16 +363,41 @@ def generate_thumbnails(image_ids):
     return generate_thumbnail.map(image_ids)()
 
 
+@shared_task
+def process_stale_stages(doc_id):
+    """Run the processing stages that have not yet run on the current contents
+    of a fetched Document. If the document is unchanged since it was last
+    processed, nothing is run. Each stage records the hash of its input when
+    it completes (see Document.mark_processed).
+    """
+    doc = Document.objects.get(pk=doc_id)
+    if not doc.document:
+        return
+
+    stages = []
+    if not doc.stage_is_current("images"):
+        stages.append(extract_images.si(doc.pk) | generate_thumbnails.s())
+    if not doc.stage_is_current("thumbnail"):
+        stages.append(generate_doc_thumbnail.si(doc.pk))
+    if not doc.stage_is_current("text"):
+        # The attributes are skipped if the extracted text is unchanged:
+        stages.append(extract_text.si(doc.pk) | add_doc_attributes.si(doc.pk))
+    elif "attributes" not in doc.derived_from:
+        stages.append(add_doc_attributes.si(doc.pk))
+
+    if stages:
+        celery.group(stages)()
+    else:
+        task_logger.info("Document #%i has already been processed", doc.pk)
+
+    return len(stages)
+
+
 def process_document(doc):
     """
-    Run all tasks on a Document.
+    Fetch a Document, then run the processing stages whose inputs changed.
     """
-    # Seems like a new bug in Celery: chain subtasks in a group do not seem to
-    # receive the result from the previous task in the chain.
-    (fetch_document.s() | celery.group(
-        extract_images.s(doc.id) | generate_thumbnails.s(),
-        generate_doc_thumbnail.s(),
-        extract_text.s(doc.id) | add_doc_attributes.s()))(doc.id)
+    (fetch_document.s() | process_stale_stages.s())(doc.id)
 
 
 def process_proposal(proposal):
@@ -290,13 +411,73 @@ def process_proposal(proposal):
     return proposal.id
 
 
-@shared_task
-def fetch_proposals(since=None,
-                    coder_type=settings.GEOCODER,
-                    importers=Importers):
+def default_since():
+    "If an importer has no record of a previous run, start from last Monday."
+    now = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return now - timedelta(days=7 + now.weekday())
+
+
+def start_import_run(importer, since=None):
+    """Create an ImportRun for a proposal importer. If `since` is not given,
+    the run resumes from the high-water mark of the importer's last
+    successful run.
     """
-    Task that scrapes the reports and decisions page
+    importer_name = type(importer).__name__
+    run = ImportRun(importer=importer_name, kind=ImportRun.PROPOSALS)
+    if not since:
+        since = ImportRun.objects.checkpoint(importer_name,
+                                             ImportRun.PROPOSALS)
+    if not since:
+        # Fall back to the latest proposal from the same region:
+        latest_proposal = Proposal.objects.filter(
+            region_name=importer.region_name).order_by("-created").first()
+        since = latest_proposal.updated if latest_proposal else \
+                default_since()
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    run.since = since
+
+    return run
+
+
+def save_proposals(run, found):
+    """Create or update proposals from the dictionaries returned by an
+    importer, and finish the run.
+
+    :returns: A list of the created or updated Proposals
     """
+    failed = []
+
+    def log_error(p_dict, exc):
+        task_logger.error("Could not create proposal from dictionary: %s",
+                          p_dict)
+        task_logger.error("%s", exc)
+        run.add_error("{}: {}".format(p_dict.get("case_number"), exc))
+        failed.append(p_dict.get("updated_date"))
+
+    results = Proposal.create_or_update_proposals_from_dicts(
+        found, on_error=log_error)
+    run.created_count = sum(1 for created, _ in results if created)
+    run.updated_count = len(results) - run.created_count
+    high_water_mark = max([p.updated for _, p in results] + [run.since])
+    if failed:
+        # Resume from before the proposals that could not be saved, so that
+        # the next import tries them again:
+        if all(failed):
+            high_water_mark = min(high_water_mark,
+                                  min(failed) - timedelta(seconds=1))
+        else:
+            high_water_mark = run.since
+    run.high_water_mark = high_water_mark
+    run.finish()
+    task_logger.info("Saved %i proposals from %s in %s (fetched in %s)",
+                     len(results), run.importer, run.save_time,
+                     run.fetch_time)
+
+    return [p for _, p in results]
+
+
+def make_geocoder(coder_type=settings.GEOCODER):
     if coder_type == "google":
         geocoder = gmaps.GoogleGeocoder(settings.GOOGLE_API_KEY)
         geocoder.bounds = settings.GEO_BOUNDS
@@ -304,54 +485,190 @@ def fetch_proposals(since=None,
         geocoder = arcgis.ArcGISCoder(settings.ARCGIS_CLIENT_ID,
                                       settings.ARCGIS_CLIENT_SECRET)
 
-    # TODO: If `since` is not provided explicitly, we should probably determine
-    # the appropriate date on a per-importer basis.
-    if since:
-        since = datetime.fromtimestamp(since)
-    else:
-        latest_proposal = Proposal.objects.latest()
-        if latest_proposal:
-            since = latest_proposal.updated
-
-        if not since:
-            # If there is no record of a previous run, fetch
-            # proposals posted since the previous Monday.
-            now = datetime.now().replace(
-                hour=0, minute=0, second=0, microsecond=0)
-            since = now - timedelta(days=7 + now.weekday())
-
-    proposals_json = []
-    for importer in importers:
-        importer_name = type(importer).__name__
-        try:
-            found = list(importer.updated_since(since, geocoder))
-        except Exception as err:
-            task_logger.warning("Error in importer: %s - %s", importer_name,
-                                err)
-            continue
+    return geocoder
+
+
+def get_importer(importer_name):
+    for importer in Importers:
+        if type(importer).__name__ == importer_name:
+            return importer
+
+    raise KeyError(f"No registered importer named {importer_name}")
+
+
+def importer_results_key(run_id):
+    return f"import_run:{run_id}:results"
+
+
+@shared_task(bind=True, default_retry_delay=RETRY_DELAY)
+def fetch_importer_proposals(self, importer_name, since=None,
+                             coder_type=settings.GEOCODER, run_id=None):
+    """Run a single proposal importer and geocode the proposals it finds.
 
-        task_logger.info("Fetched %i proposals from %s",
-                         len(found), type(importer).__name__)
-        proposals_json += found
+    The proposals are saved by save_imported_proposals, which runs once the
+    importers have all finished (see fetch_proposals). They are handed over
+    in the cache, since they cannot be serialized as JSON.
 
+    :param since: a timestamp, or None to resume from the importer's
+    checkpoint
+
+    :returns: a dictionary with the `run` id and the `key` of the cached
+    results, which is None if the importer failed
+    """
+    run = None
+    try:
+        importer = get_importer(importer_name)
+        if run_id:
+            run = ImportRun.objects.get(pk=run_id)
+        else:
+            run = start_import_run(importer,
+                                   since and datetime.fromtimestamp(since))
+        run.attempts += 1
+        run.save()
+
+        return run_importer(self, importer, run, since, coder_type)
+    except Retry:
+        raise
+    except Exception as err:
+        # Any other failure would fail the chord, and the proposals fetched by
+        # the other importers would not be saved:
+        task_logger.exception("Could not run importer %s", importer_name)
+        if run and run.pk:
+            run.add_error(err)
+            try:
+                run.finish(succeeded=False)
+            except Exception:
+                task_logger.exception("Could not record the failed run")
+        return {"run": run and run.pk, "key": None}
+
+
+def run_importer(task, importer, run, since, coder_type):
+    "Does the work of fetch_importer_proposals."
+    importer_name = run.importer
+    try:
+        found = list(importer.updated_since(run.since,
+                                            make_geocoder(coder_type),
+                                            run=run))
+    except SoftTimeLimitExceeded:
+        task_logger.warning("Importer %s exceeded its time limit",
+                            importer_name)
+        run.add_error(f"Exceeded time limit after {run.pages} pages")
+        run.finish(succeeded=False)
+        return {"run": run.pk, "key": None}
+    except Exception as err:
+        task_logger.warning("Error in importer: %s - %s (attempt %i)",
+                            importer_name, err, run.attempts)
+        run.add_error(err)
+        max_retries = getattr(importer, "max_retries", IMPORTER_RETRIES)
+        if task.request.retries < max_retries:
+            run.save()
+            raise task.retry(exc=err, max_retries=max_retries,
+                             args=(importer_name, since, coder_type),
+                             kwargs={"run_id": run.pk})
+        run.finish(succeeded=False)
+        return {"run": run.pk, "key": None}
+
+    run.seen = len(found)
+    run.fetched = timezone.now()
+    run.save()
+    task_logger.info("Fetched %i proposals from %s in %s", len(found),
+                     importer_name, run.fetch_time)
+
+    key = importer_results_key(run.pk)
+    cache.set(key, found, IMPORTER_RESULTS_TIMEOUT)
+
+    return {"run": run.pk, "key": key}
+
+
+@shared_task(soft_time_limit=SAVE_TIME_LIMIT)
+def save_imported_proposals(results):
+    """Save the proposals fetched by each importer. This is the callback of the
+    chord started by fetch_proposals, so the upserts are not run concurrently.
+
+    :returns: A list of the created or updated proposal ids
+    """
     proposals = []
+    for result in results:
+        if not result["key"]:
+            continue
 
-    for p_dict in proposals_json:
-        try:
-            (is_new, p) = Proposal.create_or_update_proposal_from_dict(p_dict)
-            p.save()
-            proposals.append(p)
-        except Exception as exc:
-            task_logger.error("Could not create proposal from dictionary: %s",
-                              p_dict)
-            task_logger.error("%s", exc)
+        run = ImportRun.objects.get(pk=result["run"])
+        found = cache.get(result["key"])
+        if found is None:
+            run.add_error("Fetched proposals expired from the cache")
+            run.finish(succeeded=False)
+            continue
+
+        saved = save_proposals(run, found)
+        cache.delete(result["key"])
+        refetch_documents(saved, run.started)
+        proposals += saved
+
+    schedule_summary_refresh()
+    regenerate_feeds.delay()
+    # Importing proposals may also create events:
+    generate_calendars.delay()
 
     return [p.id for p in proposals]
 
 
+def refetch_documents(proposals, before):
+    """Fetch the documents of proposals that an importer has seen again, if
+    they were created before the import started. New documents are processed
+    when they are created (see document_hook). Re-fetches are conditional,
+    and only the processing stages whose inputs changed are run again.
+    """
+    for doc in Document.objects.filter(proposal__in=proposals,
+                                       created__lt=before).only("id"):
+        process_document(doc)
+
+
+def import_all_proposals(since=None, coder_type=settings.GEOCODER,
+                         importers=None):
+    """Start one fetch_importer_proposals task per importer, so that the
+    importers run in parallel and a slow or failing importer does not hold up
+    the others. Each runs with its own time limit and retry policy
+    (`time_limit` and `max_retries` attributes on the importer).
+
+    :param since: a timestamp; by default, each importer resumes from its own
+    checkpoint
+    :param importers: a list of importers, defaulting to all registered
+    importers
+
+    :returns: the AsyncResult of save_imported_proposals
+    """
+    fetches = []
+    for importer in (Importers if importers is None else importers):
+        time_limit = getattr(importer, "time_limit", IMPORTER_TIME_LIMIT)
+        fetches.append(fetch_importer_proposals.signature(
+            (type(importer).__name__, since, coder_type),
+            soft_time_limit=time_limit,
+            # Leave time to record the failure:
+            time_limit=time_limit + 30))
+
+    if not fetches:
+        return save_imported_proposals.delay([])
+
+    return celery.chord(fetches)(save_imported_proposals.s())
+
+
+@shared_task
+def fetch_proposals(since=None, coder_type=settings.GEOCODER):
+    """
+    Task that runs the proposal importers.
+
+    :returns: The id of the task that saves the fetched proposals
+    """
+    return import_all_proposals(since, coder_type).id
+
+
 @shared_task
 def pull_updates(since=None, importers_filter=None):
-    "Run all registered proposal importers."
+    """Run the registered proposal importers, or those whose region names
+    contain `importers_filter`.
+
+    :returns: The id of the task that saves the fetched proposals
+    """
     importers = Importers
     if importers_filter:
         name = importers_filter.lower()
@@ -359,37 +676,68 @@ def pull_updates(since=None, importers_filter=None):
             imp for imp in importers if name in imp.region_name.lower()
         ]
 
-    return fetch_proposals(since, importers=importers)
+    return import_all_proposals(since, importers=importers).id
 
 
 # Event tasks
+def import_events(importer, since=None):
+    """Run an event importer and save the events it finds, recording the run
+    in the ImportRun ledger.
+
+    :returns: A list of Events
+    """
+    importer_name = type(importer).__name__
+    run = ImportRun(importer=importer_name, kind=ImportRun.EVENTS)
+    if not since:
+        since = ImportRun.objects.checkpoint(importer_name, ImportRun.EVENTS)
+    if not since:
+        last_event = Event.objects.filter(
+            region_name=importer.region_name).order_by("-created").first()
+        since = last_event and last_event.created
+    if since and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    run.since = since
+
+    events = []
+    posted = []
+    try:
+        for ejson in importer.updated_since(since, run=run):
+            run.seen += 1
+            events.append(Event.make_event(ejson))
+            if ejson.get("posted"):
+                posted.append(ejson["posted"])
+    except Exception as err:
+        task_logger.warning("Error in event importer: %s - %s",
+                            importer_name, err)
+        run.add_error(err)
+        run.finish(succeeded=False)
+        return events
+
+    logger.info("Fetched %i events from %s", len(events), importer_name)
+    run.created_count = sum(1 for event in events
+                            if event.created >= run.started)
+    run.updated_count = len(events) - run.created_count
+    run.high_water_mark = max(posted + ([since] if since else []),
+                              default=None)
+    run.finish()
+
+    return events
+
+
 @shared_task
 def pull_events(since=None):
     """
-    Runs all registered event importers.
+    Runs all registered event importers. Unless `since` is given, each
+    importer resumes from its own checkpoint.
     """
     if since:
         since = datetime.fromtimestamp(since)
 
     events = []
     for importer in EventImporters:
-        if not since:
-            all_events = Event.objects.filter(
-                region_name=importer.region_name).order_by("-created")
-            try:
-                last_event = all_events[0]
-                if not last_event.created.tzinfo:
-                    since = pytz.utc.localize(last_event.created)
-            except IndexError:
-                pass
-
-        importer_events = [
-            Event.make_event(ejson) for ejson in importer.updated_since(since)
-        ]
-        events += importer_events
+        events += import_events(importer, since)
 
-        logger.info("Fetched %i events from %s",
-                    len(importer_events), type(importer).__name__)
+    generate_calendars.delay()
 
     return [event.pk for event in events]
 
@@ -408,7 +756,11 @@ def cloud_vision_process(image_id):
         return
 
     city_name = re.split(r"\s*,\s*", image.region_name, 1)[0]
-    processed = vision.process_image(image.image.path, )
+    processed = vision.process_image(image.image.path)
+    if not processed:
+        # Leave the image unchecked, so that it is tried again:
+        return
+
     logo = processed.get("logo")
     if logo:
         if city_name in logo["description"]:
@@ -421,7 +773,9 @@ def cloud_vision_process(image_id):
 
 def process_image(image):
     if vision.CLIENT:
-        cloud_vision_process.delay(image.pk)
+        # Images may be saved inside a transaction (see
+        # documents.replace_images):
+        transaction.on_commit(lambda: cloud_vision_process.delay(image.pk))
 
 
 @receiver(post_save, sender=Image, dispatch_uid="process_image")
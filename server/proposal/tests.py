@@ -1,6 +1,22 @@
-#from django.test import TestCase
+from datetime import datetime
+from unittest.mock import patch
+
+from celery.exceptions import SoftTimeLimitExceeded
+
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
 from hypothesis.extra.django.models import models
-from proposal.models import Proposal
+import pytz
+
+from proposal import tasks
+from proposal.models import (Attribute, Document, DocumentText, Event,
+                             Image, ImportRun, Proposal, ProposalSummary)
+from proposal.query import canonicalize_query
+from proposal.tiles import snap_box
+from proposal.views import list_key, proposals_json
 
 from hypothesis import given
 from hypothesis import strategies
@@ -36,3 +52,208 @@ proposal_strategy = fixed_dictionaries({
 def generate_proposal(p):
     pass
 
+
+def make_proposals(n, start=0):
+    """Create n proposals, each with a document, image and attribute. Uses
+    bulk_create so that the post_save processing hooks are not triggered.
+    """
+    now = pytz.utc.localize(datetime.utcnow())
+    proposals = Proposal.objects.bulk_create([
+        Proposal(case_number="PB 2017-{}".format(i),
+                 address="{} Highland Ave".format(i),
+                 location=Point(-71.1, 42.39),
+                 updated=now)
+        for i in range(start, start+n)])
+    proposals = Proposal.objects.filter(
+        case_number__in=[p.case_number for p in proposals])
+    Document.objects.bulk_create([
+        Document(proposal=p, url="http://example.com/{}.pdf".format(p.pk),
+                 title="Staff Report", field="reports")
+        for p in proposals])
+    Image.objects.bulk_create([
+        Image(proposal=p, url="http://example.com/{}.jpg".format(p.pk),
+              width=100, height=100)
+        for p in proposals])
+    Attribute.objects.bulk_create([
+        Attribute(proposal=p, name="Applicant Name", handle="applicant_name",
+                  text_value="Applicant", published=now)
+        for p in proposals])
+    ProposalSummary.refresh()
+
+
+class ProposalJSONQueryCountTest(TestCase):
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            pjson = proposals_json(Proposal.objects.all(), include_images=1,
+                                   include_events=True)
+        return len(pjson), len(context.captured_queries)
+
+    def test_constant_queries(self):
+        make_proposals(5)
+        small_count, small_queries = self.count_queries()
+
+        make_proposals(200, start=5)
+        large_count, large_queries = self.count_queries()
+
+        self.assertEqual(small_count, 5)
+        self.assertEqual(large_count, 205)
+        self.assertEqual(small_queries, large_queries)
+
+
+
+def make_proposal_dict(i, **kwargs):
+    "Returns a proposal dictionary, as an importer would."
+    now = pytz.utc.localize(datetime.utcnow())
+    p_dict = {"case_number": "PB 2017-{}".format(i),
+              "address": "{} Highland Ave".format(i),
+              "lat": 42.39, "long": -71.1,
+              "updated_date": now,
+              "complete": False,
+              "events": [{"title": "Planning Board",
+                          "date": pytz.utc.localize(datetime(2017, 5, 1)),
+                          "region_name": "Somerville, MA"}]}
+    p_dict.update(kwargs)
+    return p_dict
+
+
+class CreateProposalsTest(TestCase):
+
+    def test_bad_row(self):
+        errors = []
+        results = Proposal.create_or_update_proposals_from_dicts(
+            [make_proposal_dict(1), make_proposal_dict(2, address="x" * 200),
+             make_proposal_dict(3)],
+            on_error=lambda p_dict, exc: errors.append(p_dict))
+
+        self.assertEqual([p.case_number for _, p in results],
+                         ["PB 2017-1", "PB 2017-3"])
+        self.assertEqual([p_dict["case_number"] for p_dict in errors],
+                         ["PB 2017-2"])
+        event = Event.objects.get()
+        self.assertEqual(event.proposals.count(), 2)
+
+
+
+class FakeImporter(object):
+    region_name = "Somerville, MA"
+    max_retries = 1
+
+    def __init__(self, *results):
+        self.results = list(results)
+
+    def updated_since(self, since, geocoder=None, run=None):
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@patch("proposal.tasks.make_geocoder", lambda coder_type: None)
+class ImporterTaskTest(TestCase):
+    def fetch(self, importer):
+        with patch("proposal.tasks.Importers", [importer]):
+            return tasks.fetch_importer_proposals.apply(
+                ("FakeImporter", None, "arcgis"))
+
+    def test_retry(self):
+        p_dicts = [make_proposal_dict(1)]
+        self.fetch(FakeImporter(ValueError("Unavailable"), p_dicts))
+
+        run = ImportRun.objects.get()
+        self.assertEqual(run.attempts, 2)
+        self.assertIsNotNone(run.fetched)
+        self.assertEqual(len(cache.get(tasks.importer_results_key(run.pk))),
+                         1)
+
+    def test_failure(self):
+        result = self.fetch(FakeImporter(ValueError("1"), ValueError("2")))
+
+        self.assertIsNone(result.get()["key"])
+        run = ImportRun.objects.get()
+        self.assertFalse(run.succeeded)
+        self.assertEqual(run.errors, ["1", "2"])
+
+    def test_time_limit(self):
+        result = self.fetch(FakeImporter(SoftTimeLimitExceeded()))
+
+        self.assertIsNone(result.get()["key"])
+        run = ImportRun.objects.get()
+        self.assertEqual(run.attempts, 1)
+        self.assertFalse(run.succeeded)
+
+    def test_unknown_importer(self):
+        with patch("proposal.tasks.Importers", []):
+            result = tasks.fetch_importer_proposals.apply(("FakeImporter",))
+
+        self.assertEqual(result.get(), {"run": None, "key": None})
+
+    @patch("proposal.tasks.schedule_summary_refresh")
+    @patch("proposal.tasks.regenerate_feeds")
+    @patch("proposal.tasks.generate_calendars")
+    def test_save(self, *mocks):
+        run = ImportRun.objects.create(importer="FakeImporter",
+                                       kind=ImportRun.PROPOSALS,
+                                       since=pytz.utc.localize(
+                                           datetime(2017, 1, 1)))
+        cache.set("fetched", [make_proposal_dict(1)])
+
+        ids = tasks.save_imported_proposals(
+            [{"run": run.pk, "key": "fetched"}, {"run": None, "key": None}])
+
+        self.assertEqual(len(ids), 1)
+        run.refresh_from_db()
+        self.assertTrue(run.succeeded)
+        self.assertEqual(run.created_count, 1)
+
+    def test_failed_row_mark(self):
+        def updated(month):
+            return pytz.utc.localize(datetime(2017, month, 1))
+
+        run = ImportRun.objects.create(importer="FakeImporter",
+                                       kind=ImportRun.PROPOSALS,
+                                       since=updated(1))
+        tasks.save_proposals(run, [
+            make_proposal_dict(1, updated_date=updated(3)),
+            make_proposal_dict(2, updated_date=updated(2), address="x" * 200),
+            make_proposal_dict(3, updated_date=updated(4))])
+
+        run.refresh_from_db()
+        self.assertEqual(run.updated_count + run.created_count, 2)
+        # The next import resumes before the proposal that failed:
+        self.assertLess(run.high_water_mark, updated(2))
+
+
+class CanonicalizeQueryTest(SimpleTestCase):
+    def test_equivalent_queries(self):
+        self.assertEqual(
+            canonicalize_query({"region": "Somerville, MA;Cambridge, MA",
+                                "box": "42.30,-71.1,42.4,-71.0",
+                                "callback": "jsonp123"}),
+            canonicalize_query({"box": "42.3,-71.10,42.40,-71",
+                                "status": "Active",
+                                "region": "Cambridge, MA;Somerville, MA"}))
+
+    def test_tiled_boxes(self):
+        # Both boxes fall within the same tiles at zoom 15, but other views
+        # filter on the exact box:
+        small = {"box": "42.385,-71.101,42.388,-71.095", "zoom": "15"}
+        large = {"box": "42.384,-71.102,42.389,-71.094", "zoom": "15"}
+        self.assertNotEqual(canonicalize_query(small),
+                            canonicalize_query(large))
+        self.assertEqual(list_key(small, snap_box(small)),
+                         list_key(large, snap_box(large)))
+
+
+class DocumentTextTest(SimpleTestCase):
+    @given(text())
+    def test_round_trip(self, s):
+        doc_text = DocumentText()
+        doc_text.text = s
+        self.assertEqual(doc_text.text, s)
+
+    def test_pages(self):
+        doc_text = DocumentText(page_offsets=[0, 7])
+        doc_text.text = "Page 1\n" + "Page 2 " * 1000
+        self.assertTrue(doc_text.compressed)
+        self.assertEqual(doc_text.pages()[0], "Page 1\n")
+        self.assertTrue(doc_text.pages()[1].startswith("Page 2"))
@@ -0,0 +1,162 @@
+"""
+Map viewports rarely line up exactly, so caching proposal list queries by their
+bounding box is not very effective. Instead, when a request includes the map's
+zoom level, its box is snapped outward to the slippy map tiles that cover it
+and the ids of the matching proposals are cached per tile. A viewport can then
+be answered by taking the union of the tiles' id sets, querying the database
+only for the tiles that are not already cached.
+
+Each tile has its own cache generation, which is bumped when a proposal inside
+it changes, so that edits do not invalidate the tiles for the whole map.
+"""
+from django.contrib.gis.geos import Polygon
+from django.core.cache import cache
+
+import math
+
+from shared import cache as cache_utils
+
+
+# Only snap to tiles at zoom levels where a viewport covers a handful of them:
+TILE_ZOOMS = range(12, 19)
+# Fall back to an ordinary query if a box would cover more tiles than this:
+MAX_TILES = 64
+TILE_TIMEOUT = 86400
+
+# Queries using these parameters depend on data that does not invalidate the
+# tiles:
+UNCACHEABLE_PARAMS = {"text", "event"}
+
+STATS_NAMESPACE = "proposal_tiles"
+
+
+def tile_for(lat, lng, zoom):
+    "Returns the (x, y) coordinates of the tile containing a point."
+    n = 2 ** zoom
+    lat_r = math.radians(max(min(lat, 85.0511), -85.0511))
+    x = int((lng + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(lat_r)) / math.pi) / 2 * n)
+
+    return (min(max(x, 0), n - 1), min(max(y, 0), n - 1))
+
+
+def tile_bounds(x, y, zoom):
+    "Returns the bounds of a tile as (lngMin, latMin, lngMax, latMax)."
+    n = 2 ** zoom
+
+    def tile_lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return (x / n * 360 - 180, tile_lat(y + 1),
+            (x + 1) / n * 360 - 180, tile_lat(y))
+
+
+def snap_box(d):
+    """If the query dictionary `d` includes a `box` and a `zoom` at which
+    tiles are cached, find the tiles covering the box.
+
+    :returns: A (zoom, x_min, x_max, y_min, y_max) tuple, or None if the query
+    cannot be answered from tiles
+    """
+    if "box" not in d or "zoom" not in d or UNCACHEABLE_PARAMS & set(d):
+        return None
+
+    try:
+        zoom = int(d["zoom"])
+        lat_min, lng_min, lat_max, lng_max = \
+            (float(coord) for coord in d["box"].split(","))
+    except ValueError:
+        return None
+
+    if zoom not in TILE_ZOOMS:
+        return None
+
+    # Tile y coordinates increase toward the south:
+    x_min, y_max = tile_for(lat_min, lng_min, zoom)
+    x_max, y_min = tile_for(lat_max, lng_max, zoom)
+    if (x_max - x_min + 1) * (y_max - y_min + 1) > MAX_TILES:
+        return None
+
+    return (zoom, x_min, x_max, y_min, y_max)
+
+
+def tile_namespace(zoom, x, y):
+    return "proposal_tile:{}:{}:{}".format(zoom, x, y)
+
+
+def invalidate_location(point):
+    "Invalidate the cached tiles containing the point at every zoom level."
+    if not point:
+        return
+
+    for zoom in TILE_ZOOMS:
+        cache_utils.bump_generation(tile_namespace(zoom, *tile_for(point.y,
+                                                                   point.x,
+                                                                   zoom)))
+
+
+def tile_keys(zoom, tiles, filters):
+    namespaces = {tile: tile_namespace(zoom, *tile) for tile in tiles}
+    gens = cache.get_many([cache_utils.generation_key(ns)
+                           for ns in namespaces.values()])
+    filters_hash = cache_utils.hash_key(filters)
+
+    keys = {}
+    for tile, ns in namespaces.items():
+        gen = gens.get(cache_utils.generation_key(ns))
+        if gen is None:
+            gen = cache_utils.generation(ns)
+        keys[tile] = "{}:{}:{}".format(ns, gen, filters_hash)
+
+    return keys
+
+
+def tile_proposal_ids(proposals, filters, snapped):
+    """Find the ids of the proposals in the tiles, using the cached id sets
+    where possible.
+
+    :param proposals: a Proposal QuerySet, filtered by everything except the
+    box
+    :param filters: a JSON-serializable value identifying the filters
+    applied to `proposals`
+    :param snapped: a tuple returned by snap_box
+
+    :returns: a set of proposal ids
+    """
+    zoom, x_min, x_max, y_min, y_max = snapped
+    tiles = [(x, y) for x in range(x_min, x_max + 1)
+             for y in range(y_min, y_max + 1)]
+    keys = tile_keys(zoom, tiles, filters)
+    cached = cache.get_many(list(keys.values()))
+    missing = [tile for tile in tiles if keys[tile] not in cached]
+
+    cache_utils.record_stat(STATS_NAMESPACE, "hits", len(tiles) - len(missing))
+    cache_utils.record_stat(STATS_NAMESPACE, "misses", len(missing))
+
+    ids = set()
+    for id_set in cached.values():
+        ids |= id_set
+
+    if missing:
+        # Fetch the missing tiles with a single query on the bounding box
+        # enclosing them, then sort the results into tiles.
+        lng_min, lat_min, _, _ = tile_bounds(min(x for x, _ in missing),
+                                             max(y for _, y in missing), zoom)
+        _, _, lng_max, lat_max = tile_bounds(max(x for x, _ in missing),
+                                             min(y for _, y in missing), zoom)
+        bbox = Polygon.from_bbox((lng_min, lat_min, lng_max, lat_max))
+        found = {tile: set() for tile in missing}
+        # bboverlaps compiles to the && operator, which is answered by the
+        # GiST index on location:
+        for pk, location in proposals.filter(location__bboverlaps=bbox)\
+                                     .values_list("pk", "location"):
+            tile = tile_for(location.y, location.x, zoom)
+            if tile in found:
+                found[tile].add(pk)
+
+        cache.set_many({keys[tile]: id_set for tile, id_set in found.items()},
+                       TILE_TIMEOUT)
+        for id_set in found.values():
+            ids |= id_set
+
+    return ids
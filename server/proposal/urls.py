@@ -11,9 +11,12 @@ doc_urlpatterns = [
 urlpatterns = [
     url(r"^list$", views.list_proposals, name="list-proposals"),
     url(r"^closed$", views.closed_proposals),
+    url(r"^clusters$", views.cluster_proposals, name="cluster-proposals"),
+    url(r"^cache_stats$", views.cache_stats),
     url(r"^view$", views.view_proposal),
     url(r"^view/(?P<pk>[0-9]+)$", views.view_proposal, name="view-proposal"),
     url(r"^events$", views.list_events, name="list-events"),
+    url(r"^events\.ics$", views.events_calendar, name="events-calendar"),
     url(r"^event/(?P<pk>[0-9]+)$", views.view_event),
     url(r"^image/(?P<pk>[0-9]+)$", views.view_image),
     url(r"^image$", views.view_image),
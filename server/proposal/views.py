@@ -1,19 +1,50 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from celery import shared_task
+from datetime import date
+from dateutil.parser import parse as dt_parse
+from itertools import islice
+import json
+import re
 
 from django.conf import settings
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.db.models import Prefetch, Q
 from django.forms.models import model_to_dict
-from django.http import FileResponse
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition
 
-from shared.request import make_response, ErrorResponse
+from cornerwise.utils import estimate_count
+from shared import cache as cache_utils
+from shared.request import (make_response, make_streaming_response,
+                            ErrorResponse)
 
-from .models import Proposal, Attribute, Document, Event, Image
-from .query import build_proposal_query
+from . import ical
+from .models import (Proposal, Attribute, Document, Event, Image,
+                     ProposalSummary, CACHE_NAMESPACE, LIST_ATTRIBUTES)
+from .query import (build_proposal_query, canonicalize_query,
+                    proposal_clusters, rank_proposals)
+from .tiles import snap_box, tile_proposal_ids
+from parcel.models import CACHE_NAMESPACE as PARCEL_NAMESPACE
 
-default_attributes = [
-    "applicant_name", "legal_notice", "dates_of_public_hearing"
-]
+default_attributes = LIST_ATTRIBUTES
+
+
+def summary_images(include_images):
+    "Can the images be read from ProposalSummary?"
+    return include_images is not True and include_images == 1
+
+
+def summary_attributes(include_attributes):
+    "Can the attributes be read from ProposalSummary?"
+    return include_attributes == default_attributes
+
+
+def get_summary(proposal):
+    try:
+        return proposal.summary
+    except ProposalSummary.DoesNotExist:
+        # The summary has not been refreshed since the proposal was created.
+        return None
 
 
 def proposal_json(proposal,
@@ -21,29 +52,53 @@ def proposal_json(proposal,
                   include_attributes=default_attributes,
                   include_events=False,
                   include_documents=True,
-                  include_projects=True):
-    pdict = model_to_dict(proposal, exclude=["location", "fulltext"])
-    pdict["location"] = {
-        "lat": proposal.location.y,
-        "lng": proposal.location.x
-    }
+                  include_projects=True,
+                  fields=None):
+    """Serialize a Proposal as a dictionary.
+
+    :param fields: If given, a set of the Proposal fields to include.
+    Otherwise, all fields are included.
+    """
+    pdict = model_to_dict(proposal, fields=fields,
+                          exclude=["location", "search_vector"])
+    if not fields or "location" in fields:
+        pdict["location"] = {
+            "lat": proposal.location.y,
+            "lng": proposal.location.x
+        }
 
     if include_documents:
         pdict["documents"] = [d.to_dict() for d in proposal.document_set.all()]
 
-    if include_images:
-        images = proposal.images.order_by("-priority")
-        # Booleans are considered integers
-        if isinstance(include_images, int) and include_images is not True:
-            images = images[0:include_images]
+    summary = None
+    if summary_images(include_images) or \
+       summary_attributes(include_attributes):
+        summary = get_summary(proposal)
 
-        pdict["images"] = [img.to_dict() for img in images]
+    if include_images:
+        if summary and summary_images(include_images):
+            pdict["images"] = summary.images_json()
+        else:
+            images = getattr(proposal, "ordered_images", None)
+            if images is None:
+                images = proposal.images.order_by("-priority")
+            # Booleans are considered integers
+            if isinstance(include_images, int) and include_images is not True:
+                images = images[0:include_images]
+
+            pdict["images"] = [img.to_dict() for img in images]
 
     if include_attributes:
-        attributes = Attribute.objects.filter(proposal=proposal)
-        if include_attributes is not True:
-            attributes = attributes.filter(handle__in=include_attributes)
-        pdict["attributes"] = [a.to_dict() for a in attributes]
+        if summary and summary_attributes(include_attributes):
+            pdict["attributes"] = summary.attributes
+        else:
+            attributes = getattr(proposal, "included_attributes", None)
+            if attributes is None:
+                attributes = Attribute.objects.filter(proposal=proposal)
+                if include_attributes is not True:
+                    attributes = attributes.filter(
+                        handle__in=include_attributes)
+            pdict["attributes"] = [a.to_dict() for a in attributes]
 
     if include_events:
         pdict["events"] = [e.to_json_dict() for e in proposal.events.all()]
@@ -53,78 +108,344 @@ def proposal_json(proposal,
 
     # TODO: Filter on parcel attributes
 
-    # TODO: fulltext query
-
     return pdict
 
+
+def prefetch_for_json(proposals,
+                      include_images=True,
+                      include_attributes=default_attributes,
+                      include_events=False,
+                      include_documents=True,
+                      include_projects=True,
+                      fields=None):
+    """Prepare a Proposal queryset for serialization with proposal_json.
+
+    Loads the related objects that proposal_json will need for the whole
+    queryset at once, so that serializing the results runs a fixed number of
+    queries, regardless of how many proposals there are. If `fields` is
+    given, only those columns are loaded.
+
+    The first image and the default attributes are read from the
+    ProposalSummary materialized view. Proposals created since it was last
+    refreshed fall back to querying their images and attributes individually.
+
+    :param proposals: A Proposal QuerySet
+    :returns: A QuerySet
+    """
+    prefetches = []
+
+    if fields:
+        columns = set(fields) | {"id"}
+        if include_projects:
+            columns.add("project")
+        proposals = proposals.only(*columns)
+    else:
+        proposals = proposals.defer("search_vector")
+
+    if include_documents:
+        prefetches.append(
+            Prefetch("document_set",
+                     queryset=Document.objects.defer("search_vector")))
+
+    if summary_images(include_images) or \
+       summary_attributes(include_attributes):
+        # The list-level fields are precomputed:
+        prefetches.append("summary")
+
+    if include_images and not summary_images(include_images):
+        prefetches.append(
+            Prefetch("images",
+                     queryset=Image.objects.order_by("-priority"),
+                     to_attr="ordered_images"))
+
+    if include_attributes and not summary_attributes(include_attributes):
+        attributes = Attribute.objects.all()
+        if include_attributes is not True:
+            attributes = attributes.filter(handle__in=include_attributes)
+        prefetches.append(
+            Prefetch("attributes", queryset=attributes,
+                     to_attr="included_attributes"))
+
+    if include_events:
+        prefetches.append("events")
+
+    if include_projects:
+        proposals = proposals.select_related("project")
+        prefetches.append("project__budgetitem_set")
+
+    return proposals.prefetch_related(*prefetches)
+
+
+def proposals_json(proposals, **kwargs):
+    """Serialize a Proposal queryset, batching the queries for related objects.
+
+    Accepts the same keyword arguments as proposal_json and produces the same
+    output as calling it on each proposal.
+    """
+    return [proposal_json(proposal, **kwargs)
+            for proposal in prefetch_for_json(proposals, **kwargs)]
+
+
+def iter_proposals_json(proposals, chunk_size=500, **kwargs):
+    """Like proposals_json, but returns a generator. Proposals are loaded and
+    serialized `chunk_size` at a time, so memory use does not grow with the
+    size of the result.
+    """
+    ids = proposals.values_list("pk", flat=True).iterator()
+    while True:
+        chunk = list(islice(ids, chunk_size))
+        if not chunk:
+            break
+
+        loaded = prefetch_for_json(Proposal.objects.filter(pk__in=chunk),
+                                   **kwargs)
+        by_id = {proposal.pk: proposal for proposal in loaded}
+        for pk in chunk:
+            # The proposal may have been deleted in the meantime:
+            if pk in by_id:
+                yield proposal_json(by_id[pk], **kwargs)
+
+proposal_fields = {field.name for field in Proposal._meta.concrete_fields} - \
+                  {"search_vector"}
+
+# Maps the names of relations that can be requested using the `fields`
+# parameter to the corresponding proposal_json option, and the value to use for
+# that option if the view does not specify one:
+relation_fields = {
+    "documents": ("include_documents", True),
+    "images": ("include_images", True),
+    "attributes": ("include_attributes", default_attributes),
+    "events": ("include_events", True),
+    "project": ("include_projects", True),
+}
+
+
+def field_options(query, **defaults):
+    """Determine the options to pass to proposal_json (and prefetch_for_json)
+    from the `fields` parameter of a request, if present. It should be a
+    comma-separated list of Proposal fields and relations (documents, images,
+    attributes, events, project). Relations that are not listed are skipped
+    entirely. The id is always included.
+
+    :param query: A dictionary-like object, typically request.GET
+    :param defaults: The options to use for relations that are requested, or
+    for all relations if `fields` is not specified
+
+    :returns: A dictionary of keyword arguments
+    """
+    fields_param = query.get("fields")
+    if not fields_param:
+        return defaults
+
+    requested = set(re.split(r"\s*,\s*", fields_param.strip()))
+    options = {"fields": (requested & proposal_fields) | {"id"}}
+    for name, (option, default) in relation_fields.items():
+        if name in requested:
+            options[option] = defaults.get(option) or default
+        else:
+            options[option] = False
+
+    return options
+
+
+def query_key(query):
+    """Canonicalize a proposal query for use in cache keys and ETags. Lot size
+    groups are recalculated when parcels are imported, so queries that filter
+    on them also depend on the parcel cache generation.
+    """
+    key = canonicalize_query(query)
+    if "lotsize" in query:
+        key.append(("parcel", cache_utils.generation(PARCEL_NAMESPACE)))
+
+    return key
+
+
 # Views:
 
+# Proposal views send validators that change whenever any of the data that
+# could be included in the response changes.
+proposal_etag = cache_utils.request_etag(CACHE_NAMESPACE, query_key)
+proposal_last_modified = cache_utils.request_last_modified(CACHE_NAMESPACE)
+validators = {"etag": proposal_etag, "last_modified": proposal_last_modified}
+
+
+def events_etag(req, *args, **kwargs):
+    # The upcoming events also change from day to day:
+    return "{}-{}".format(proposal_etag(req, *args, **kwargs),
+                          date.today().isoformat())
+
+
+# Cached responses are invalidated when proposals change, so this only bounds
+# how long stale generations linger in Redis.
+LIST_CACHE_TIMEOUT = 60*60*24
+# Larger responses are streamed without being cached:
+LIST_CACHE_MAX_ITEMS = 2000
+
+
+def list_key(query, snapped):
+    """Returns the cache key for a list response. Viewports that cover the
+    same tiles return the same proposals from the tile cache, so a tiled query
+    is keyed on its tiles rather than on its exact box.
+    """
+    if snapped:
+        filters = {k: query[k] for k in query if k not in ("box", "zoom")}
+        return ["list", query_key(filters), snapped]
+
+    return ["list", query_key(query)]
+
+
+def tiled_proposal_ids(query, snapped):
+    """Find the ids of the proposals matching the query in the map tiles
+    covering its box.
+    """
+    filters = {k: query[k] for k in query if k not in ("box", "zoom")}
+
+    return tile_proposal_ids(
+        Proposal.objects.filter(build_proposal_query(filters)),
+        query_key(filters), snapped)
 
-@make_response("list.djhtml")
+
+@make_streaming_response("list.djhtml", **validators)
 def list_proposals(req):
+    snapped = snap_box(req.GET)
+    key = cache_utils.cache_key(CACHE_NAMESPACE, list_key(req.GET, snapped))
+    cached = cache_utils.get_cached(CACHE_NAMESPACE, key)
+    if cached is not None:
+        return cached
+
+    if snapped:
+        proposals = Proposal.objects.filter(pk__in=tiled_proposal_ids(req.GET,
+                                                                      snapped))
+    else:
+        proposals = Proposal.objects.filter(build_proposal_query(req.GET))
+    proposals = rank_proposals(proposals, req.GET)
+    pjson = iter_proposals_json(proposals,
+                                **field_options(req.GET, include_images=1))
+
+    return {"proposals": cache_utils.caching_iterator(
+        key, pjson, lambda pjson: {"proposals": pjson},
+        max_items=LIST_CACHE_MAX_ITEMS,
+        timeout=LIST_CACHE_TIMEOUT)}
+
+
+@make_response()
+def cache_stats(req):
+    "Report the hit rate of the proposal response cache."
+    return cache_utils.get_stats(CACHE_NAMESPACE)
+
+
+# Clusters are roughly 64 pixels wide on 256 pixel map tiles:
+CELLS_PER_TILE = 4
+
+
+@make_response(**validators)
+def cluster_proposals(req):
+    """Group the proposals matching the query into grid cells sized for the
+    map's `zoom` level, so that the client does not have to receive and
+    cluster every proposal in the viewport.
+    """
+    try:
+        zoom = int(req.GET["zoom"])
+    except KeyError:
+        raise ErrorResponse("Missing required parameter: zoom", status=400)
+    except ValueError as err:
+        raise ErrorResponse("Bad value for zoom", {"zoom": req.GET["zoom"]},
+                            status=400, err=err)
+
+    cell_size = 360 / 2**max(zoom, 0) / CELLS_PER_TILE
     proposals = Proposal.objects.filter(build_proposal_query(req.GET))
-    if "include_projects" in req.GET:
-        proposals = proposals.select_related("project")
 
-    pjson = [
-        proposal_json(
-            proposal, include_images=1) for proposal in proposals
-    ]
+    return {"clusters": proposal_clusters(proposals, cell_size),
+            "cell_size": cell_size}
 
-    return {"proposals": pjson}
 
+PAGE_SIZE = 100
 
-@make_response("list.djhtml")
-def paginated_active_proposals(req):
-    proposal_query = Proposal.objects.filter(build_proposal_query(req.GET))
-    if "include_projects" in req.GET:
-        proposal_query = proposal_query.select_related("project")
-    paginator = Paginator(proposal_query, per_page=100)
 
-    page = req.GET.get("page")
+def encode_cursor(proposal):
+    "Returns an opaque cursor pointing just past the given proposal."
+    position = json.dumps([proposal.updated.isoformat(), proposal.pk])
+    return urlsafe_b64encode(position.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Returns a Q object that selects the proposals after the position encoded
+    in the cursor. Proposals are ordered by (updated, id), most recent first.
+    """
     try:
-        proposals = paginator.page(page)
-    except PageNotAnInteger:
-        proposals = paginator.page(1)
-    except EmptyPage as err:
-        raise ErrorResponse("No such page", {"page": page}, err=err)
-
-    pjson = [
-        proposal_json(
-            proposal, include_images=1) for proposal in proposals
-    ]
-
-    return {
-        "proposals": pjson,
-        # "count": proposals.paginator.count,
-        "page": proposals.number,
-        "total_pages": proposals.paginator.num_pages
+        updated, pk = json.loads(urlsafe_b64decode(cursor).decode("utf-8"))
+        updated = dt_parse(updated)
+        pk = int(pk)
+    except (TypeError, ValueError) as err:
+        raise ErrorResponse("Invalid cursor", {"cursor": cursor}, status=400,
+                            err=err)
+
+    return Q(updated__lt=updated) | Q(updated=updated, pk__lt=pk)
+
+
+@make_response("list.djhtml", **validators)
+def paginated_active_proposals(req):
+    """Returns a page of proposals matching the query. Rather than a page
+    number, it accepts the opaque `cursor` value returned as `next` in the
+    previous page, so the cost of fetching a page does not depend on how deep
+    it is. Pass `estimate=1` to include an estimate of the total number of
+    matching proposals.
+    """
+    proposal_query = Proposal.objects.filter(build_proposal_query(req.GET))
+    page_query = proposal_query
+
+    cursor = req.GET.get("cursor")
+    if cursor:
+        page_query = page_query.filter(decode_cursor(cursor))
+
+    page_query = page_query.order_by("-updated", "-pk")
+    options = field_options(req.GET, include_images=1)
+    load_options = dict(options)
+    if "fields" in options:
+        # Needed for the cursor:
+        load_options["fields"] = options["fields"] | {"updated"}
+    # Fetch one extra proposal to determine if there is a next page:
+    proposals = list(
+        prefetch_for_json(page_query, **load_options)[0:PAGE_SIZE+1])
+    has_next = len(proposals) > PAGE_SIZE
+    proposals = proposals[0:PAGE_SIZE]
+
+    response = {
+        "proposals": [proposal_json(proposal, **options)
+                      for proposal in proposals],
+        "next": encode_cursor(proposals[-1]) if has_next else None
     }
 
+    if req.GET.get("estimate"):
+        response["estimated_total"] = estimate_count(proposal_query)
+
+    return response
 
-@make_response("list.djhtml")
+
+@make_streaming_response("list.djhtml", **validators)
 def closed_proposals(req):
     proposals = Proposal.objects.filter(complete=True)
 
-    return {"proposals": list(map(proposal_json, proposals))}
+    return {"proposals": iter_proposals_json(proposals)}
 
 
-@make_response("view.djhtml")
+@make_response("view.djhtml", **validators)
 def view_proposal(req, pk=None):
     if not pk:
         pk = req.GET.get("pk")
 
-    proposal = get_object_or_404(Proposal, pk=pk)
+    options = field_options(req.GET,
+                            include_attributes=True,
+                            include_images=True,
+                            include_events=True)
+    proposals = prefetch_for_json(Proposal.objects.all(), **options)
+    proposal = get_object_or_404(proposals, pk=pk)
 
-    return proposal_json(
-        proposal,
-        include_attributes=True,
-        include_images=True,
-        include_events=True)
+    return proposal_json(proposal, **options)
 
 
 # Document views
-@make_response()
+@make_response(**validators)
 def view_document(req, pk):
     "Retrieve details about a Document."
     doc = get_object_or_404(Document, pk=pk)
@@ -145,32 +466,69 @@ def download_document(req, pk):
     return FileResponse(doc.document)
 
 
-@make_response()
-def list_events(req):
-    events = Event.objects.upcoming()
+# Linked proposals are serialized with these options in event responses:
+event_proposal_options = {"include_images": False,
+                          "include_attributes": ical.EVENT_ATTRIBUTES,
+                          "include_documents": False}
+
+
+def events_json(events):
+    """Serialize an Event queryset along with each event's proposals. The
+    proposals and their attributes are loaded for all the events at once.
+    """
+    proposals = prefetch_for_json(Proposal.objects.all(),
+                                  **event_proposal_options)
+    events = events.prefetch_related(Prefetch("proposals", queryset=proposals))
 
-    return {"events": [event.to_json_dict() for event in events]}
+    event_dicts = []
+    for event in events:
+        d = event.to_json_dict()
+        d["proposals"] = [proposal_json(proposal, **event_proposal_options)
+                          for proposal in event.proposals.all()]
+        event_dicts.append(d)
 
+    return event_dicts
 
-@make_response("event.djhtml")
+
+@make_response(etag=events_etag)
+def list_events(req):
+    # Saving or linking an event bumps the proposal cache generation:
+    return cache_utils.get_or_compute(
+        CACHE_NAMESPACE, ["events", date.today().isoformat()],
+        lambda: {"events": [event.to_json_dict()
+                            for event in Event.objects.upcoming()]},
+        timeout=LIST_CACHE_TIMEOUT)
+
+
+@make_response("event.djhtml", **validators)
 def view_event(req, pk=None):
     if not pk:
         pk = req.GET.get("pk")
 
-    event = get_object_or_404(Event, pk=pk)
-    d = event.to_json_dict()
-    d["proposals"] = [
-        proposal_json(
-            p,
-            include_images=False,
-            include_attributes=["applicant_name", "legal_notice"],
-            include_documents=False)
-        for p in event.proposals.all().select_related("project")
-    ]
-    return {"event": d}
+    def get_event():
+        events = events_json(Event.objects.filter(pk=pk))
+        if not events:
+            raise Http404("No event found")
+        return {"event": events[0]}
 
+    return cache_utils.get_or_compute(CACHE_NAMESPACE, ["event", pk],
+                                      get_event, timeout=LIST_CACHE_TIMEOUT)
 
-@make_response()
+
+@condition(etag_func=lambda req: ical.get_calendar(
+    req.GET.get("region"))["etag"])
+def events_calendar(req):
+    """An iCalendar feed of the events in a region (or in all regions). The
+    feeds are regenerated after events are imported, rather than per request.
+    """
+    calendar = ical.get_calendar(req.GET.get("region"))
+    response = HttpResponse(calendar["text"],
+                            content_type="text/calendar; charset=utf-8")
+    response["Content-Disposition"] = "inline; filename=events.ics"
+    return response
+
+
+@make_response(**validators)
 def view_image(req, pk=None):
     if not pk:
         pk = req.GET.get("pk")
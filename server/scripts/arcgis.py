@@ -1,10 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
 import json
+import logging
 import re
+import socket
+import threading
+import time
+from urllib.error import URLError
 from urllib.parse import urlencode
 from urllib.request import urlopen
 
+from shared import api_cache
 
-ADDRESS_URL = "http://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer/geocodeAddresses"
+logger = logging.getLogger(__name__)
+
+SERVICE_URL = "http://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer"
+ADDRESS_URL = SERVICE_URL + "/geocodeAddresses"
+TOKEN_URL = "https://www.arcgis.com/sharing/oauth2/token"
+
+# Used if the service does not report its own batch size:
+DEFAULT_BATCH_SIZE = 150
+# Refresh the access token this many seconds before it is due to expire:
+TOKEN_MARGIN = 60
+# Error codes returned for an invalid or expired token:
+TOKEN_ERRORS = {498, 499}
+
+
+class ArcGISError(Exception):
+    pass
 
 
 def camel_to_under(s):
@@ -31,51 +53,156 @@ def simplify(result):
     }
 
 
+def split_region(region):
+    """Split a region name like 'Somerville, MA' into a city and a region
+    (state).
+    """
+    if not region:
+        return None, None
+    parts = re.split(r"\s*,\s*", region.strip(), 1)
+    return parts[0], (parts[1] if len(parts) > 1 else None)
+
+
+def post_json(url, data, timeout):
+    with urlopen(url, urlencode(data).encode("ISO-8859-1"),
+                 timeout=timeout) as f:
+        return json.loads(f.read().decode("utf-8"))
+
+
 class ArcGISCoder(object):
-    def __init__(self, client_id, client_secret, url=ADDRESS_URL):
+    def __init__(self, client_id, client_secret, url=ADDRESS_URL,
+                 parallelism=4, batch_size=None, timeout=60,
+                 token_url=TOKEN_URL):
+        """
+        :param parallelism: the number of batches to send at once
+        :param batch_size: the number of addresses to send per request;
+        defaults to the batch size suggested by the service
+        :param timeout: the timeout for each request, in seconds
+        """
         assert client_id and client_secret, \
             "You must supply a client id and secret to ArcGISCoder"
 
         self.client_id = client_id
         self.client_secret = client_secret
         self.url = url
+        self.token_url = token_url
+        self.parallelism = parallelism
+        self.timeout = timeout
+        self._batch_size = batch_size
         self.access_token = None
-
-    def get_access_token(self):
-        if self.access_token:
+        self.token_expires = 0
+        self.token_lock = threading.Lock()
+
+    def get_access_token(self, refresh=False):
+        """Returns an access token, requesting a new one if there is none or
+        the current token is about to expire.
+        """
+        with self.token_lock:
+            if self.access_token and not refresh and \
+               time.monotonic() < self.token_expires:
+                return self.access_token
+
+            json_response = post_json(self.token_url,
+                                      [("grant_type", "client_credentials"),
+                                       ("client_id", self.client_id),
+                                       ("client_secret", self.client_secret)],
+                                      self.timeout)
+            if "error" in json_response:
+                raise ArcGISError(json_response["error"])
+
+            self.access_token = json_response["access_token"]
+            self.token_expires = time.monotonic() + \
+                json_response["expires_in"] - TOKEN_MARGIN
             return self.access_token
 
-        data = urlencode([("grant_type", "client_credentials"),
-                          ("client_id", self.client_id),
-                          ("client_secret", self.client_secret)]).\
-                          encode("ISO-8859-1")
-        f = urlopen("https://www.arcgis.com/sharing/oauth2/token",
-                    data)
-        json_response = json.loads(f.read().decode("utf-8"))
-
-        self.access_token = json_response["access_token"]
-        return self.access_token
-
-    def geocode(self, addrs, **kwargs):
+    @property
+    def batch_size(self):
+        "The maximum number of addresses to send in one request."
+        if not self._batch_size:
+            self._batch_size = DEFAULT_BATCH_SIZE
+            try:
+                service_url = self.url.rsplit("/", 1)[0]
+                info = post_json(service_url,
+                                 {"f": "json",
+                                  "token": self.get_access_token()},
+                                 self.timeout)
+                props = info.get("locatorProperties", {})
+                self._batch_size = props.get("SuggestedBatchSize") or \
+                    props.get("MaxBatchSize") or DEFAULT_BATCH_SIZE
+            except (ArcGISError, URLError, socket.timeout, ValueError) as err:
+                logger.warning("Could not retrieve the ArcGIS batch size: %s",
+                               err)
+
+        return self._batch_size
+
+    def geocode(self, addrs, region=None, **kwargs):
+        """Geocode a list of addresses.
+
+        :param region: a region name of the form 'City, State', such as the
+        `region_name` of an importer
+
+        :returns: a list of simplified results in the same order as `addrs`,
+        with None for each address that could not be geocoded
+        """
         if isinstance(addrs, str):
             addrs = [addrs]
-
-        addresses = json.dumps(
-            {"records":
-             [{"attributes":
-               {
-                   "OBJECTID": i+1,
-                   "Address": addr,
-                   "City": "Somerville",
-                   "Region": "MA"
-               }} for i, addr in enumerate(addrs)]})
-        data = {
-            "addresses": addresses,
-            "token": self.get_access_token(),
-            "f": "json"
-        }
-
-        f = urlopen(self.url, urlencode(data).encode("ISO-8859-1"))
-        result = json.loads(f.read().decode("utf-8"))
-
-        return [simplify(l) for l in result["locations"]]
+        city, state = split_region(region)
+
+        return api_cache.cached_batch(
+            "geocode:arcgis", [[addr, city, state] for addr in addrs],
+            self.geocode_uncached)
+
+    def geocode_uncached(self, requests):
+        """Geocode a list of [address, city, region] requests, split into
+        batches that are sent concurrently.
+        """
+        size = self.batch_size
+        batches = [requests[i:i+size] for i in range(0, len(requests), size)]
+        if len(batches) == 1:
+            return self.geocode_batch(batches[0])
+
+        with ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+            return [result for results in pool.map(self.geocode_batch, batches)
+                    for result in results]
+
+    def geocode_batch(self, requests):
+        """Send a single geocodeAddresses request. Results are matched to
+        requests by their ResultID, since the service does not return them in
+        order.
+
+        :returns: a list of results in the order of `requests`, with None for
+        unmatched addresses and api_cache.ERROR for all the requests if the
+        batch failed
+        """
+        records = []
+        for i, (addr, city, state) in enumerate(requests):
+            attributes = {"OBJECTID": i, "Address": addr}
+            if city:
+                attributes["City"] = city
+            if state:
+                attributes["Region"] = state
+            records.append({"attributes": attributes})
+        data = {"addresses": json.dumps({"records": records}),
+                "f": "json"}
+
+        try:
+            for refresh in (False, True):
+                data["token"] = self.get_access_token(refresh)
+                result = post_json(self.url, data, self.timeout)
+                error = result.get("error")
+                if not (error and error.get("code") in TOKEN_ERRORS):
+                    break
+            if error:
+                raise ArcGISError(error)
+        except (ArcGISError, URLError, socket.timeout, ValueError) as err:
+            logger.error("Error geocoding %i addresses: %s", len(requests),
+                         err)
+            return [api_cache.ERROR] * len(requests)
+
+        found = [None] * len(requests)
+        for location in result["locations"]:
+            attrs = location["attributes"]
+            if attrs.get("Status") != "U" and location.get("location"):
+                found[attrs["ResultID"]] = simplify(location)
+
+        return found
@@ -1,16 +1,18 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 from urllib.error import HTTPError
 from urllib.parse import urlencode
 from urllib.request import urlopen
 
+from shared import api_cache
 from shared.address import same_address
 
 
 FOURSQUARE_URL = "https://api.foursquare.com/v2/venues/search"
+VENUES_TTL = timedelta(days=30)
 
 
-def find_venues(params, client_id, client_secret):
+def search_venues(params, client_id, client_secret):
     data = [
         ("intent", "checkin"),
         ("radius", params.get("radius", "20")),
@@ -46,6 +48,29 @@ def find_venues(params, client_id, client_secret):
         return False, None
 
 
+def find_venues(params, client_id, client_secret):
+    """Search for venues matching the params. Successful searches are cached.
+
+    :returns: a pair (found, venues). If the search failed, `found` is False
+    and the error is returned in place of the venues.
+    """
+    errors = []
+
+    def fetch():
+        found, venues = search_venues(params, client_id, client_secret)
+        if found:
+            return venues
+        errors.append(venues)
+        return api_cache.ERROR
+
+    venues = api_cache.cached_call("foursquare:venues", sorted(params.items()),
+                                   fetch, ttl=VENUES_TTL)
+    if errors:
+        return False, errors[0]
+
+    return True, venues
+
+
 def find_venue(params, *args):
     found, venues = find_venues(params, *args)
     if found:
@@ -1,16 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
 import json
-import threading
-from queue import Queue
-
 import logging
+import socket
+import time
 
+from urllib.error import HTTPError, URLError
 from urllib.parse import urlencode
 from urllib.request import urlopen
 
+from shared import api_cache
+from scripts.throttle import TokenBucket, backoff_delay
+
 logger = logging.getLogger(__name__)
 
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
 
-def geocode(api_key, address, bounds=None):
+# Responses with these statuses may succeed if the request is repeated:
+RETRY_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+
+
+class RetryableError(Exception):
+    pass
+
+
+def geocode_response(api_key, address, bounds=None, url=GEOCODE_URL,
+                     timeout=30):
     data = [
         ("key", api_key),
         ("address", address),
@@ -18,11 +32,14 @@ def geocode(api_key, address, bounds=None):
     ]
 
     query = urlencode(data)
-    url = "https://maps.googleapis.com/maps/api/geocode/json?" + query
 
-    f = urlopen(url)
-    body = f.read().decode("utf-8")
-    json_response = json.loads(body)
+    with urlopen(url + "?" + query, timeout=timeout) as f:
+        body = f.read().decode("utf-8")
+    return json.loads(body)
+
+
+def geocode(api_key, address, bounds=None):
+    json_response = geocode_response(api_key, address, bounds)
 
     if json_response["status"] == "OK":
         return json_response["results"][0]
@@ -47,35 +64,24 @@ returns a flattened dict conforming to the generic geocoder expectations.
         }
 
 
-class GeocoderThread(threading.Thread):
-    def __init__(self, addr_q, out, geocoder):
-        self.addr_q = addr_q
-        self.out = out
-        self.geocoder = geocoder
-        super().__init__()
-
-    def start(self):
-        while True:
-            address = self.addr_q.get_nowait()
-
-            if not address:
-                break
-
-            try:
-                print("Geocoding address:", address)
-                result = geocode(self.geocoder.api_key, address)
-                # Could return None
-                self.out.append((address, result and simplify(result)))
-            except Exception as err:
-                print("Error in thread", self, err)
-            finally:
-                self.addr_q.task_done()
-
-
 class GoogleGeocoder(object):
-    def __init__(self, api_key):
+    def __init__(self, api_key, parallelism=5, rate=50, retries=3,
+                 url=GEOCODE_URL, timeout=30):
+        """
+        :param parallelism: the number of requests to send at once
+        :param rate: the maximum number of requests per second; the default
+        is the standard quota for the Geocoding API
+        :param retries: the number of times to retry a request that failed
+        with a server or network error, or because the quota was exceeded
+        :param url: the geocoder endpoint
+        """
         self.api_key = api_key
         self._bounds = None
+        self.parallelism = parallelism
+        self.limiter = TokenBucket(rate)
+        self.retries = retries
+        self.url = url
+        self.timeout = timeout
 
     @property
     def bounds(self):
@@ -87,32 +93,51 @@ class GoogleGeocoder(object):
         self._bounds = "{bounds[0]},{bounds[3]}|{bounds[2]},{bounds[1]}"\
             .format(bounds=bounds)
 
-    def geocode_threaded(self, addrs, parallelism=5):
-        address_q = Queue(len(addrs))
-        for addr in addrs:
-            address_q.put_nowait(addr)
+    def geocode_one(self, addr, bounds=None):
+        """Geocode a single address, retrying with exponential backoff.
 
-        # Use a list to collect results, because .append() is
-        # thread-safe
-        out = []
-
-        for i in range(parallelism):
-            gt = GeocoderThread(address_q, out, self)
-            gt.start()
-
-        address_q.join()
-
-        # Out is a list of pairs of (addr, result)
-        results = dict(out)
-
-        # Pluck out the results in the same order as the input
-        # addresses:
-        return [results[a] for a in addrs]
+        :returns: a simplified result, None if the address was not found, or
+        api_cache.ERROR if the request failed
+        """
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            try:
+                json_response = geocode_response(self.api_key, addr, bounds,
+                                                 self.url, self.timeout)
+                status = json_response["status"]
+                if status in RETRY_STATUSES:
+                    raise RetryableError(status)
+            except (RetryableError, URLError, socket.timeout) as err:
+                if isinstance(err, HTTPError) and err.code < 500 and \
+                   err.code != 429:
+                    logger.error("Error geocoding address %s: %s", addr, err)
+                    return api_cache.ERROR
+                if attempt < self.retries:
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                logger.error("Giving up geocoding address %s: %s", addr, err)
+                return api_cache.ERROR
+
+            if status == "OK":
+                return simplify(json_response["results"][0])
+            elif status == "ZERO_RESULTS":
+                return None
+
+            # Do not cache errors, such as a denied request:
+            logger.error("Error encountered while geocoding address: "
+                         "%s\n%s", addr, json_response)
+            return api_cache.ERROR
+
+    def geocode_uncached(self, requests):
+        """Geocode a list of (address, bounds) pairs concurrently, subject to
+        the rate limit. The results are in the same order as the requests.
+        """
+        with ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+            return list(pool.map(lambda r: self.geocode_one(*r), requests))
 
     def geocode(self, addrs, bounds=None, region=None):
-        results = []
-        for addr in addrs:
-            if region:
-                addr += " " + region
-            results.append(simplify(geocode(self.api_key, addr, self.bounds)))
-        return results
+        if region:
+            addrs = [addr + " " + region for addr in addrs]
+        return api_cache.cached_batch(
+            "geocode:google", [[addr, self.bounds] for addr in addrs],
+            self.geocode_uncached)
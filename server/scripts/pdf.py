@@ -2,6 +2,12 @@ from PyPDF2 import PdfFileReader
 from PIL import Image
 import os
 from io import BytesIO
+import re
+import subprocess
+import unicodedata
+
+# Control characters other than tab and newline:
+CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
 
 
 def xobjects(pdf):
@@ -61,3 +67,48 @@ def extract_images(path, filter_fn=default_guard, limit=10):
         if i == limit:
             break
 
+
+def normalize_text(text):
+    """Normalize extracted text: compose Unicode characters and expand
+    ligatures, use \\n line endings, strip trailing whitespace from lines and
+    remove control characters.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = CONTROL_CHARS.sub("", text)
+    return "\n".join(line.rstrip() for line in text.split("\n"))
+
+
+def join_pages(text):
+    """Normalize the text of a document whose pages are separated by form
+    feeds, as pdftotext writes it.
+
+    :returns: a tuple of the normalized text and a list of the offsets in the
+    text at which each page begins
+    """
+    # The last page is also followed by a form feed:
+    pages = text.split("\f")
+    if pages and not pages[-1].strip():
+        pages.pop()
+
+    offsets = []
+    length = 0
+    for i, page in enumerate(pages):
+        page = normalize_text(page)
+        pages[i] = page if page.endswith("\n") else page + "\n"
+        offsets.append(length)
+        length += len(pages[i])
+
+    return "".join(pages), offsets
+
+
+def extract_text(path, timeout=300):
+    """Extract the text of a PDF with pdftotext, preserving its layout into
+    lines, which the property extractors rely on.
+
+    :returns: a tuple of the normalized text and a list of the offsets in the
+    text at which each page begins
+    """
+    out = subprocess.check_output(["pdftotext", "-enc", "UTF-8", path, "-"],
+                                  stderr=subprocess.DEVNULL, timeout=timeout)
+    return join_pages(out.decode("utf-8", "replace"))
@@ -0,0 +1,178 @@
+from django.test import SimpleTestCase
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+from scripts import arcgis, gmaps, pdf
+from scripts.throttle import TokenBucket
+from shared import api_cache
+
+
+class StubGeocoderHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        address = parse_qs(urlparse(self.path).query)["address"][0]
+        server = self.server
+        with server.lock:
+            server.requests.append(address)
+            attempts = server.requests.count(address)
+
+        if address == "nowhere":
+            response = {"status": "ZERO_RESULTS", "results": []}
+        elif address == "busy" and attempts == 1:
+            response = {"status": "OVER_QUERY_LIMIT", "results": []}
+        else:
+            response = {"status": "OK",
+                        "results": [{"geometry": {"location": {
+                                        "lat": len(address), "lng": 0}},
+                                     "formatted_address": address.upper(),
+                                     "place_id": address,
+                                     "types": ["street_address"]}]}
+
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class GoogleGeocoderTest(SimpleTestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), StubGeocoderHandler)
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.geocoder = gmaps.GoogleGeocoder(
+            "key", parallelism=4, rate=100,
+            url="http://127.0.0.1:{}/".format(self.server.server_port))
+        no_backoff = patch("scripts.gmaps.backoff_delay", return_value=0)
+        no_backoff.start()
+        self.addCleanup(no_backoff.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_results_in_order(self):
+        addrs = ["{} Main St".format(i) for i in range(20)]
+        results = self.geocoder.geocode_uncached([(a, None) for a in addrs])
+        self.assertEqual([r["formatted_name"] for r in results],
+                         [a.upper() for a in addrs])
+
+    def test_not_found_and_retry(self):
+        results = self.geocoder.geocode_uncached([("nowhere", None),
+                                                  ("busy", None)])
+        self.assertIsNone(results[0])
+        self.assertEqual(results[1]["formatted_name"], "BUSY")
+        self.assertEqual(self.server.requests.count("busy"), 2)
+
+    def test_gives_up(self):
+        self.geocoder.url = "http://127.0.0.1:1/"
+        self.geocoder.retries = 1
+        self.assertIs(self.geocoder.geocode_one("1 Main St"),
+                      api_cache.ERROR)
+
+
+class StubArcGISHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        data = parse_qs(self.rfile.read(length).decode("ISO-8859-1"))
+        server = self.server
+
+        if self.path == "/token":
+            with server.lock:
+                server.tokens += 1
+                token = "token{}".format(server.tokens)
+            response = {"access_token": token, "expires_in": 7200}
+        elif data["token"][0] in server.expired:
+            response = {"error": {"code": 498, "message": "Invalid token"}}
+        else:
+            records = json.loads(data["addresses"][0])["records"]
+            with server.lock:
+                server.batches.append(len(records))
+            # Results are not returned in the order of the records:
+            response = {"locations": [
+                {"location": {"x": 0, "y": len(r["attributes"]["Address"])},
+                 "score": 100,
+                 "attributes": {
+                     "ResultID": r["attributes"]["OBJECTID"],
+                     "Status": "U" if r["attributes"]["Address"] == "nowhere"
+                     else "M",
+                     "Match_addr": "{Address}, {City}".format(**r["attributes"]),
+                     "Addr_type": "PointAddress"}}
+                for r in reversed(records)]}
+
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ArcGISCoderTest(SimpleTestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), StubArcGISHandler)
+        self.server.tokens = 0
+        self.server.expired = set()
+        self.server.batches = []
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base = "http://127.0.0.1:{}".format(self.server.server_port)
+        self.geocoder = arcgis.ArcGISCoder(
+            "id", "secret", url=base + "/geocodeAddresses",
+            token_url=base + "/token", batch_size=3)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_batches(self):
+        addrs = ["{} Main St".format(i) for i in range(8)] + ["nowhere"]
+        results = self.geocoder.geocode_uncached(
+            [[addr, "Somerville", "MA"] for addr in addrs])
+        self.assertEqual(sorted(self.server.batches), [3, 3, 3])
+        self.assertEqual([r and r["formatted_name"] for r in results],
+                         ["{}, Somerville".format(a) for a in addrs[:-1]] +
+                         [None])
+
+    def test_refreshes_token(self):
+        self.geocoder.geocode_batch([["1 Main St", "Somerville", "MA"]])
+        self.server.expired.add("token1")
+        results = self.geocoder.geocode_batch([["2 Main St", "Cambridge",
+                                                "MA"]])
+        self.assertEqual(results[0]["formatted_name"], "2 Main St, Cambridge")
+        self.assertEqual(self.server.tokens, 2)
+
+    def test_split_region(self):
+        self.assertEqual(arcgis.split_region("Somerville, MA"),
+                         ("Somerville", "MA"))
+        self.assertEqual(arcgis.split_region(None), (None, None))
+
+
+class TokenBucketTest(SimpleTestCase):
+    def test_rate(self):
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        bucket = TokenBucket(10, capacity=1, clock=lambda: now[0],
+                             sleep=sleep)
+        for _ in range(11):
+            bucket.acquire()
+
+        self.assertAlmostEqual(now[0], 1.0)
+
+
+class NormalizeTextTest(SimpleTestCase):
+    def test_normalize(self):
+        self.assertEqual(pdf.normalize_text("\ufb01led \x07\r\nnext  "),
+                         "filed\nnext")
@@ -1,7 +1,14 @@
 import base64
+from datetime import timedelta
 import json
 from urllib import parse, request
 
+from shared import api_cache
+
+
+# The analysis of a given text does not change:
+ANALYSIS_TTL = timedelta(days=365)
+
 
 class AzureTextAnalyzer(object):
     base_url = "https://westus.api.cognitive.microsoft.com/text/analytics/v2.0/"
@@ -43,6 +50,11 @@ class AzureTextAnalyzer(object):
                  "text": text }
 
     def get_key_phrases(self, text):
+        return api_cache.cached_call("azure:key_phrases", text,
+                                     lambda: self.fetch_key_phrases(text),
+                                     ttl=ANALYSIS_TTL)
+
+    def fetch_key_phrases(self, text):
         input = {"documents": [self.make_document(text)]}
         req = self.make_request("keyPhrases", data=json.dumps(input).encode())
         response = json.loads(req.read())
@@ -60,6 +72,11 @@ class GoogleTextAnalyzer(object):
         self.api_key = api_key
 
     def get_key_phrases(self, text):
+        return api_cache.cached_call("google:entities", text,
+                                     lambda: self.fetch_key_phrases(text),
+                                     ttl=ANALYSIS_TTL)
+
+    def fetch_key_phrases(self, text):
         body = {"encodingType": "UTF8",
                 "document": {"type": "PLAIN_TEXT", "content": text}}
         query = {"key": self.api_key}
@@ -0,0 +1,43 @@
+"""
+Helpers for calling rate-limited APIs from several threads.
+"""
+import random
+import threading
+import time
+
+
+class TokenBucket(object):
+    """A thread-safe token bucket rate limiter. Tokens are added at `rate` per
+    second, up to `capacity`, and each call to acquire() takes one, waiting if
+    none are available.
+    """
+    def __init__(self, rate, capacity=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while True:
+                now = self.clock()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # Allow for rounding errors in the refill:
+                if self.tokens >= 1 - 1e-9:
+                    self.tokens -= 1
+                    return
+
+                # Other threads wait on the lock, so tokens are handed out in
+                # the order they were requested.
+                self.sleep((1 - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt, base=0.5, maximum=30):
+    "Exponential backoff with jitter, in seconds, before retry `attempt`."
+    return min(maximum, base * 2 ** attempt) * (0.5 + random.random() / 2)
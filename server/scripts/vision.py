@@ -1,5 +1,7 @@
 import base64
 from collections import OrderedDict
+from datetime import timedelta
+import hashlib
 from httplib2 import ServerNotFoundError
 import itertools
 import logging
@@ -10,7 +12,10 @@ from oauth2client.client import GoogleCredentials, ApplicationDefaultCredentials
 
 from PIL import Image
 
+from shared import api_cache
+
 DISCOVERY_URL = "https://{api}.googleapis.com/$discovery/rest?version={apiVersion}"
+ANNOTATION_TTL = timedelta(days=365)
 
 
 def get_client():
@@ -47,11 +52,36 @@ def encode_image(image_file):
 
 
 def annotate_image(client, image_file):
+    """Send an image to the Cloud Vision API. The annotations are cached by the
+    digest of the image's contents.
+
+    :returns: The API response, or None if the image could not be annotated
+    """
+    with open(image_file, "rb") as infile:
+        contents = infile.read()
+
+    def annotate():
+        response = annotate_contents(client, contents)
+        # Failures are reported per image, and may be temporary, so they are
+        # not cached:
+        errors = [r["error"] for r in response.get("responses", [])
+                  if "error" in r]
+        if errors:
+            logging.warning("Error annotating %s: %s", image_file, errors[0])
+            return api_cache.ERROR
+        return response
+
+    return api_cache.cached_call("vision:annotate",
+                                 hashlib.sha256(contents).hexdigest(),
+                                 annotate, ttl=ANNOTATION_TTL)
+
+
+def annotate_contents(client, contents):
     # TODO: Provide an image context with latLongRect (?)
     body = {
         "requests": [{
             "image": {
-                "content": encode_image(image_file)
+                "content": base64.b64encode(contents).decode("ascii")
             },
             "features": [{
                 "type": "LABEL_DETECTION",
@@ -153,8 +183,12 @@ def process_image(image_file):
     if not CLIENT: return None
 
     image = Image.open(image_file)
+    annotations = annotate_image(CLIENT, image_file)
+    if not annotations:
+        return None
+
     try:
-        response = annotate_image(CLIENT, image_file)["responses"][0]
+        response = annotations["responses"][0]
         return {"logo": find_logo(response),
                 "colorfulness": colorfulness(response)}
     except KeyError:
@@ -0,0 +1,121 @@
+"""
+A persistent cache for requests to external APIs (geocoders, Foursquare, Cloud
+Vision, text analysis), most of which are paid by the request.
+
+Responses are stored in the database (shared.models.APIResponse), so they
+survive Redis restarts, with Redis in front for fast lookups. Each entry
+expires after a TTL. Requests for which the API found nothing are cached too,
+for a shorter time, so that they are not retried on every run. Errors are not
+cached.
+"""
+from django.core.cache import cache
+from django.utils import timezone
+
+from datetime import timedelta
+
+from .cache import hash_key
+from .models import APIResponse
+
+
+DEFAULT_TTL = timedelta(days=90)
+DEFAULT_NEGATIVE_TTL = timedelta(days=7)
+
+# Returned by a fetch function in place of a response when the request failed.
+# It is not cached, and the caller receives None.
+ERROR = object()
+
+
+def redis_key(service, key):
+    return "api_response:{}:{}".format(service, key)
+
+
+def lookup_many(service, requests):
+    """Look up cached responses.
+
+    :param service: (str) names the API and the kind of request
+    :param requests: a list of JSON-serializable values identifying requests
+
+    :returns: a dictionary mapping the indices of the requests that were found
+    to their cached values
+    """
+    keys = [hash_key(request) for request in requests]
+    front = cache.get_many([redis_key(service, key) for key in keys])
+
+    found = {}
+    missing = {}
+    for i, key in enumerate(keys):
+        entry = front.get(redis_key(service, key))
+        if entry is None:
+            missing.setdefault(key, []).append(i)
+        else:
+            # Values are wrapped, so that negative results can be cached:
+            found[i] = entry[0]
+
+    if missing:
+        for response in APIResponse.objects.filter(
+                service=service, key__in=list(missing),
+                expires__gt=timezone.now()):
+            for i in missing[response.key]:
+                found[i] = response.value
+            set_front(service, response.key, response.value, response.expires)
+
+    return found
+
+
+def set_front(service, key, value, expires):
+    timeout = (expires - timezone.now()).total_seconds()
+    if timeout > 0:
+        cache.set(redis_key(service, key), (value,), int(timeout))
+
+
+def store(service, request, value, ttl=DEFAULT_TTL,
+          negative_ttl=DEFAULT_NEGATIVE_TTL):
+    "Cache the response to a request. A value of None is a negative result."
+    key = hash_key(request)
+    expires = timezone.now() + (negative_ttl if value is None else ttl)
+    APIResponse.objects.update_or_create(
+        service=service, key=key,
+        defaults={"value": value, "expires": expires})
+    set_front(service, key, value, expires)
+
+
+def cached_batch(service, requests, fn, ttl=DEFAULT_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL):
+    """Answer a batch of requests, calling `fn` only for those that are not
+    cached. Repeated requests in the batch are only sent once.
+
+    :param fn: a function that takes a list of requests and returns a list of
+    responses in the same order. A None response is cached as a negative
+    result; an ERROR response is not cached.
+
+    :returns: a list of responses in the order of `requests`
+    """
+    found = lookup_many(service, requests)
+
+    unique = {}
+    for i, request in enumerate(requests):
+        if i not in found:
+            unique.setdefault(hash_key(request), request)
+
+    if unique:
+        misses = list(unique.values())
+        fetched = dict(zip(unique, fn(misses)))
+        for key, request in unique.items():
+            if fetched[key] is ERROR:
+                fetched[key] = None
+            else:
+                store(service, request, fetched[key], ttl, negative_ttl)
+        for i, request in enumerate(requests):
+            if i not in found:
+                found[i] = fetched[hash_key(request)]
+
+    return [found[i] for i in range(len(requests))]
+
+
+def cached_call(service, request, fn, ttl=DEFAULT_TTL,
+                negative_ttl=DEFAULT_NEGATIVE_TTL):
+    """Answer a single request, calling `fn` with no arguments if it is not
+    cached.
+    """
+    return cached_batch(service, [request], lambda _: [fn()], ttl,
+                        negative_ttl)[0]
@@ -0,0 +1,172 @@
+"""
+Helpers for caching values that are invalidated all at once.
+
+Rather than tracking down and deleting every cached value that depends on some
+data, a cache 'generation' is stored for each namespace and included in the
+cache keys. Bumping the generation makes all of the old keys unreachable; they
+will be evicted by Redis in due course.
+"""
+from django.core.cache import cache
+
+from datetime import datetime, timezone
+import hashlib
+import json
+import time
+
+
+def generation_key(namespace):
+    return "generation:" + namespace
+
+
+def generation(namespace):
+    "Returns the current generation of the cache namespace."
+    key = generation_key(namespace)
+    gen = cache.get(key)
+    if gen is None:
+        # Start from the current time, so that a generation key that has been
+        # evicted is not reset to a value that was used before.
+        gen = int(time.time())
+        cache.add(key, gen, None)
+        gen = cache.get(key, gen)
+
+    return gen
+
+
+def changed_key(namespace):
+    return "generation_changed:" + namespace
+
+
+def bump_generation(namespace):
+    "Invalidates all the values cached under the namespace."
+    key = generation_key(namespace)
+    cache.set(changed_key(namespace), time.time(), None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        gen = int(time.time())
+        cache.set(key, gen, None)
+        return gen
+
+
+def last_changed(namespace):
+    """Returns a datetime (UTC) recording when the namespace's generation was
+    last bumped, or None if it is not known.
+    """
+    stamp = cache.get(changed_key(namespace))
+    return stamp and datetime.fromtimestamp(stamp, timezone.utc)
+
+
+def hash_key(value):
+    "Returns a short, stable digest of a JSON-serializable value."
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def request_etag(namespace, canonicalize=lambda query: sorted(query.items())):
+    """Returns a function suitable for use as an `etag` argument to
+    shared.request.make_response. The ETag changes whenever the generation of
+    the namespace is bumped, so it can be computed without querying the
+    database.
+
+    :param canonicalize: a function that takes the request's query parameters
+    and returns a JSON-serializable value; equivalent queries should produce
+    the same value
+    """
+    def etag(req, *args, **kwargs):
+        return "{}-{}".format(generation(namespace),
+                              hash_key([req.path, canonicalize(req.GET)]))
+
+    return etag
+
+
+def request_last_modified(namespace):
+    "Returns a function suitable as a `last_modified` argument."
+    return lambda req, *args, **kwargs: last_changed(namespace)
+
+
+def stats_key(namespace, stat):
+    return "cache_stats:{}:{}".format(namespace, stat)
+
+
+def record_stat(namespace, stat, count=1):
+    key = stats_key(namespace, stat)
+    try:
+        cache.incr(key, count)
+    except ValueError:
+        cache.set(key, count, None)
+
+
+def get_stats(namespace):
+    """Returns a dictionary with the number of cache hits and misses recorded
+    for the namespace, as well as the hit rate.
+    """
+    hits = cache.get(stats_key(namespace, "hits"), 0)
+    misses = cache.get(stats_key(namespace, "misses"), 0)
+    total = hits + misses
+
+    return {"hits": hits,
+            "misses": misses,
+            "hit_rate": hits/total if total else None,
+            "generation": cache.get(generation_key(namespace))}
+
+
+def cache_key(namespace, key):
+    """Returns the full cache key for `key` in the current generation of the
+    namespace.
+
+    :param namespace: (str) the namespace, which is also used for stats
+    :param key: a JSON-serializable value identifying the cached value
+    """
+    return "{}:{}:{}".format(namespace, generation(namespace), hash_key(key))
+
+
+def get_cached(namespace, full_key):
+    "Look up a full cache key, recording a hit or a miss for the namespace."
+    value = cache.get(full_key)
+    record_stat(namespace, "misses" if value is None else "hits")
+
+    return value
+
+
+def get_or_compute(namespace, key, fn, timeout=None):
+    """Look up `key` in the current generation of the namespace. If it is not
+    found, call `fn` to compute the value and store it.
+
+    :param namespace: (str) the namespace, which is also used for stats
+    :param key: a JSON-serializable value identifying the cached value
+    :param fn: a function of zero arguments
+    :param timeout: cache timeout (in seconds)
+
+    :returns: The cached or computed value
+    """
+    full_key = cache_key(namespace, key)
+    value = get_cached(namespace, full_key)
+    if value is None:
+        value = fn()
+        cache.set(full_key, value, timeout)
+
+    return value
+
+
+def caching_iterator(full_key, items, wrap=list, max_items=1000, timeout=None):
+    """Wraps an iterator so that, once it has been exhausted, the items it
+    produced are cached under `full_key`. If there are more than `max_items`,
+    nothing is cached and the items are not retained, so that very large
+    results can be streamed without holding them in memory.
+
+    :param full_key: a key returned by cache_key
+    :param items: an iterable
+    :param wrap: a function called with the list of items to produce the
+    value that will be cached
+    """
+    retained = []
+    for item in items:
+        if retained is not None:
+            if len(retained) < max_items:
+                retained.append(item)
+            else:
+                retained = None
+        yield item
+
+    if retained is not None:
+        cache.set(full_key, wrap(retained), timeout)
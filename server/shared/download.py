@@ -0,0 +1,161 @@
+"""
+Streaming HTTP downloads over persistent connections.
+
+Documents are usually fetched in bursts from the same few city servers. The
+pool keeps a connection open to each host (per thread), so consecutive
+downloads reuse it instead of opening a new connection each time. Response
+bodies are written to a file in chunks and hashed as they arrive, so memory
+use does not depend on the size of the file.
+"""
+from collections import namedtuple
+import hashlib
+import http.client
+import threading
+from urllib.parse import urljoin, urlsplit
+
+CHUNK_SIZE = 64 * 1024
+TIMEOUT = 60
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+# The `status` is 200, or 304 if the server reported that the resource was
+# not modified, in which case nothing was written and `size` and `sha256`
+# are None.
+Download = namedtuple("Download", ["url", "status", "size", "sha256", "etag",
+                                   "last_modified"])
+
+
+class DownloadError(Exception):
+    def __init__(self, url, status, reason):
+        super().__init__(f"{url}: {status} {reason}")
+        self.url = url
+        self.status = status
+
+
+class ConnectionPool(object):
+    "Keeps an idle keep-alive connection for each host, per thread."
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.local = threading.local()
+
+    @property
+    def idle(self):
+        if not hasattr(self.local, "idle"):
+            self.local.idle = {}
+        return self.local.idle
+
+    def acquire(self, scheme, netloc):
+        "Returns a connection to the host, and whether it was reused."
+        conn = self.idle.pop((scheme, netloc), None)
+        if conn:
+            return conn, True
+
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc,
+                                               timeout=self.timeout), False
+        return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def release(self, scheme, netloc, conn, response):
+        "Return a connection whose response has been read in full."
+        if response.will_close:
+            conn.close()
+        else:
+            old = self.idle.pop((scheme, netloc), None)
+            if old:
+                old.close()
+            self.idle[(scheme, netloc)] = conn
+
+    def request(self, method, url, headers=None):
+        """Send a request, reusing an idle connection to the host if there is
+        one. A request on a reused connection is retried once on a new
+        connection if the server has closed it in the meantime.
+
+        :returns: a tuple of (connection, response)
+        """
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        while True:
+            conn, reused = self.acquire(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, headers=headers or {})
+                return conn, conn.getresponse()
+            except (ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                if not reused:
+                    raise
+
+    def close(self):
+        for conn in self.idle.values():
+            conn.close()
+        self.idle.clear()
+
+
+default_pool = ConnectionPool()
+
+
+def download(url, outfile, etag=None, last_modified=None, pool=None):
+    """Download a URL into a file. If `etag` or `last_modified` is given, the
+    request is conditional, and nothing is downloaded if the server responds
+    with 304 Not Modified.
+
+    :param outfile: a file opened for writing in binary mode
+    :param etag: the ETag of the copy already downloaded
+    :param last_modified: the Last-Modified header of the copy already
+    downloaded
+
+    :returns: a Download
+    """
+    pool = pool or default_pool
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        conn, resp = pool.request("GET", url, headers)
+        try:
+            if resp.status in REDIRECT_STATUSES and \
+               resp.getheader("Location"):
+                resp.read()
+                pool.release(parts.scheme, parts.netloc, conn, resp)
+                url = urljoin(url, resp.getheader("Location"))
+                continue
+
+            if resp.status == 304:
+                resp.read()
+                result = Download(url, 304, None, None,
+                                  resp.getheader("ETag", etag),
+                                  resp.getheader("Last-Modified",
+                                                 last_modified))
+            elif resp.status == 200:
+                digest = hashlib.sha256()
+                size = 0
+                while True:
+                    chunk = resp.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    outfile.write(chunk)
+                    size += len(chunk)
+                result = Download(url, 200, size, digest.hexdigest(),
+                                  resp.getheader("ETag"),
+                                  resp.getheader("Last-Modified"))
+            else:
+                resp.read()
+                pool.release(parts.scheme, parts.netloc, conn, resp)
+                raise DownloadError(url, resp.status, resp.reason)
+        except DownloadError:
+            raise
+        except Exception:
+            conn.close()
+            raise
+
+        pool.release(parts.scheme, parts.netloc, conn, resp)
+        return result
+
+    raise DownloadError(url, resp.status, "Too many redirects")
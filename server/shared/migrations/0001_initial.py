@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='APIResponse',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service', models.CharField(max_length=64)),
+                ('key', models.CharField(max_length=40)),
+                ('value', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('created', models.DateTimeField(auto_now=True)),
+                ('expires', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='apiresponse',
+            unique_together=set([('service', 'key')]),
+        ),
+    ]
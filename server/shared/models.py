@@ -0,0 +1,18 @@
+from django.contrib.postgres.fields import JSONField
+from django.db import models
+
+
+class APIResponse(models.Model):
+    """
+    A cached response from an external API, such as a geocoder. A null value
+    records that the API found nothing for the request.
+    """
+    service = models.CharField(max_length=64)
+    # Digest of the request:
+    key = models.CharField(max_length=40)
+    value = JSONField(null=True)
+    created = models.DateTimeField(auto_now=True)
+    expires = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = (("service", "key"),)
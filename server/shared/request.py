@@ -1,9 +1,13 @@
 from django.contrib import messages
 from django.core.urlresolvers import reverse
 from django.core.serializers.json import DjangoJSONEncoder
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render_to_response
+from django.views.decorators.http import condition
 
+from collections.abc import Iterator
+import hashlib
+import itertools
 import logging
 import json
 import re
@@ -23,14 +27,49 @@ class ErrorResponse(Exception):
         self.redirect_back = redirect_back
 
 
+def conditional(view, etag=None, last_modified=None, template=None):
+    """Add support for conditional GET requests to a view produced by
+    make_response or make_streaming_response. If the request's If-None-Match
+    or If-Modified-Since headers match, a 304 response is returned without
+    calling the view.
+
+    :param etag: a function that is called with the view's arguments and
+    returns a string that changes whenever the view's data does. It is combined
+    with the format of the response (JSON, JSONP or HTML), since the same data
+    is rendered differently for each.
+    :param last_modified: a function called with the view's arguments that
+    returns a datetime
+    """
+    def variant_etag(req, *args, **kwargs):
+        tag = etag(req, *args, **kwargs)
+        if not tag:
+            return None
+
+        callback = req.GET.get("callback")
+        if callback:
+            variant = "jsonp:" + callback
+        else:
+            variant = "json" if wants_json(req, template) else "html"
+
+        return hashlib.sha1("{}:{}".format(tag, variant).encode("utf-8"))\
+                      .hexdigest()
+
+    return condition(variant_etag if etag else None, last_modified)(view)
+
+
 def make_response(template=None, error_template="error.djhtml",
-                  shared_context=None, redirect_back=False):
+                  shared_context=None, redirect_back=False,
+                  etag=None, last_modified=None):
     """
     View decorator
 
     Tailor the response to the requested data type, as specified
     in the Accept header. Expects the wrapped view to return a
     dict. If the request wants JSON, renders the dict as JSON data.
+
+    If `etag` and/or `last_modified` functions are provided, the response
+    includes validators and conditional GET requests are answered with a 304
+    before the view is called. See `conditional`.
     """
     def constructor_fn(view):
         def wrapped_view(req, *args, **kwargs):
@@ -61,11 +100,7 @@ def make_response(template=None, error_template="error.djhtml",
                 response["Content-type"] = "application/javascript"
                 return response
 
-            accepts = req.META["HTTP_ACCEPT"]
-
-            if not use_template \
-               or re.search(r"application/json", accepts) \
-               or req.GET.get("format", "").lower() == "json":
+            if wants_json(req, use_template):
                 response = JsonResponse(data, status=status)
                 response["Access-Control-Allow-Origin"] = "*"
                 return response
@@ -81,6 +116,107 @@ def make_response(template=None, error_template="error.djhtml",
 
             return render_to_response(use_template, data, status=status)
 
+        if etag or last_modified:
+            return conditional(wrapped_view, etag, last_modified, template)
+
+        return wrapped_view
+
+    return constructor_fn
+
+
+def wants_json(req, template=None):
+    "Returns True if the response to the request should be JSON encoded."
+    return not template \
+        or re.search(r"application/json", req.META.get("HTTP_ACCEPT", "")) \
+        or req.GET.get("format", "").lower() == "json"
+
+
+def stream_json(data, encoder=DjangoJSONEncoder, buffer_size=65536):
+    """Encode a dictionary as JSON incrementally. Values that are iterators
+    are encoded as arrays, one item at a time, so they are never held in
+    memory in their entirety.
+
+    :param data: A dictionary
+    :param buffer_size: Approximate size (in characters) of the chunks to
+    produce
+
+    :returns: A generator of strings that, concatenated, form a JSON object
+    """
+    def pieces():
+        yield "{"
+        for i, (k, v) in enumerate(data.items()):
+            yield ("," if i else "") + json.dumps(k) + ":"
+            if isinstance(v, Iterator):
+                yield "["
+                for j, item in enumerate(v):
+                    yield ("," if j else "") + json.dumps(item, cls=encoder)
+                yield "]"
+            else:
+                yield json.dumps(v, cls=encoder)
+        yield "}"
+
+    buff = []
+    size = 0
+    for piece in pieces():
+        buff.append(piece)
+        size += len(piece)
+        if size >= buffer_size:
+            yield "".join(buff)
+            buff = []
+            size = 0
+
+    if buff:
+        yield "".join(buff)
+
+
+def make_streaming_response(template=None, error_template="error.djhtml",
+                            etag=None, last_modified=None):
+    """
+    View decorator
+
+    Like make_response, but JSON and JSONP responses are streamed. The wrapped
+    view should return a dict. Its values may be iterators (e.g., generators),
+    which are consumed while the response is being sent. When rendering a
+    template, the iterators are first converted to lists.
+    """
+    def constructor_fn(view):
+        def materialized_view(req, *args, **kwargs):
+            data = view(req, *args, **kwargs)
+            return {k: list(v) if isinstance(v, Iterator) else v
+                    for k, v in data.items()}
+
+        template_view = make_response(template, error_template)(
+            materialized_view)
+
+        def wrapped_view(req, *args, **kwargs):
+            jsonp_callback = req.GET.get("callback")
+
+            if not (jsonp_callback or wants_json(req, template)):
+                return template_view(req, *args, **kwargs)
+
+            status = 200
+            try:
+                data = view(req, *args, **kwargs)
+            except ErrorResponse as err:
+                data = err.data
+                status = err.status
+
+            chunks = stream_json(data)
+
+            if jsonp_callback:
+                chunks = itertools.chain([jsonp_callback + "("], chunks, [")"])
+                content_type = "application/javascript"
+            else:
+                content_type = "application/json"
+
+            response = StreamingHttpResponse(chunks, status=status,
+                                             content_type=content_type)
+            response["Access-Control-Allow-Origin"] = "*"
+            return response
+
+        if etag or last_modified:
+            return conditional(wrapped_view, etag, last_modified, template)
+
         return wrapped_view
 
     return constructor_fn
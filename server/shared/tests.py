@@ -1,3 +1,71 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import io
+import threading
+
+from shared import download
+
+BODY = b"%PDF-1.4 " + b"x" * 200000
+ETAG = '"v1"'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.path == "/moved":
+            self.send_response(302)
+            self.send_header("Location", "/doc.pdf")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("ETag", ETAG)
+            self.send_header("Content-Length", str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTest(SimpleTestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.connections = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = "http://127.0.0.1:{}".format(self.server.server_port)
+        self.pool = download.ConnectionPool(timeout=5)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_download(self):
+        outfile = io.BytesIO()
+        result = download.download(self.base + "/moved", outfile,
+                                   pool=self.pool)
+        self.assertEqual(result.status, 200)
+        self.assertEqual(result.url, self.base + "/doc.pdf")
+        self.assertEqual(outfile.getvalue(), BODY)
+        self.assertEqual(result.size, len(BODY))
+        self.assertEqual(result.sha256, sha256(BODY).hexdigest())
+        self.assertEqual(result.etag, ETAG)
+
+    def test_not_modified(self):
+        outfile = io.BytesIO()
+        download.download(self.base + "/doc.pdf", outfile, pool=self.pool)
+        result = download.download(self.base + "/doc.pdf", outfile,
+                                   etag=ETAG, pool=self.pool)
+        self.assertEqual(result.status, 304)
+        self.assertEqual(len(outfile.getvalue()), len(BODY))
+        # Both requests were sent on the same connection:
+        self.assertEqual(len(self.server.connections), 1)
@@ -3,7 +3,7 @@ from collections import defaultdict, OrderedDict
 from django.forms.models import model_to_dict
 
 from proposal.models import Changeset, Document, Image, Proposal, Event
-from proposal.views import proposal_json
+from proposal.views import prefetch_for_json, proposal_json
 from proposal.query import build_proposal_query_dict
 
 
@@ -11,6 +11,8 @@ def summarize_query_updates(query, since, until=None):
     query_dict = build_proposal_query_dict(query)
     # Find proposals that are NEW since the given date:
     proposals = Proposal.objects.filter(created__gt=since, **query_dict)
+    proposals = prefetch_for_json(proposals, include_images=1,
+                                  include_documents=False)
     new_ids = {proposal.pk for proposal in proposals}
 
     # Find proposals that have *changed*, but which are not new:
@@ -19,6 +21,8 @@ def summarize_query_updates(query, since, until=None):
                                 .filter(updated__gt=since, **query_dict)
     if until:
         proposals_changed = proposals_changed.filter(updated__lte=until)
+    proposals_changed = prefetch_for_json(proposals_changed, include_images=1,
+                                          include_documents=False)
 
     # Start with the new proposals:
     summary = OrderedDict((p.id, {